@@ -0,0 +1,168 @@
+# api_common.py
+#
+# Configuration and request/response helpers shared by the sync Flask app
+# (app.py) and the async ASGI app (asgi_app.py).
+
+import os
+import time
+from datetime import date
+from werkzeug.exceptions import abort
+from sources import SOURCES, ALL_KEYS
+from archive import liturgical_year_range
+from quota import Quota
+
+# API keys are sent in this header or as ?api_key=
+API_KEY_HEADER = 'X-API-Key'
+
+# Requests per hour for each API key on each API route, and for each client
+# address on the documentation page
+ROUTE_LIMIT = int(os.getenv('ROUTE_LIMIT', '50'))
+DEFAULT_LIMIT = int(os.getenv('DEFAULT_LIMIT', '100'))
+# Routes with their own hourly limit. Long-poll clients reconnect every 30
+# seconds or so, and an event stream counts once per connection.
+UPDATES_LIMIT = int(os.getenv('UPDATES_LIMIT', '200'))
+ROUTE_LIMITS = {'stream_updates': UPDATES_LIMIT, 'poll_updates': UPDATES_LIMIT}
+# Endpoints served without an API key, and endpoints that are not limited at all
+PUBLIC_ENDPOINTS = {'api_documentation', 'metrics', 'static'}
+EXEMPT_ENDPOINTS = {'metrics', 'static'}
+
+_route_quotas = {}
+_default_quota = Quota('default', DEFAULT_LIMIT, 60 * 60)
+
+def load_api_keys():
+    """Load API keys from the API_KEYS environment variable."""
+    api_keys = {key.strip() for key in os.getenv('API_KEYS', '').split(',') if key.strip()}
+    if not api_keys:
+        raise ValueError("No API keys set. Please set the 'API_KEYS' environment variable.")
+    return api_keys
+
+def request_quota(request, api_keys):
+    """Authenticate a request and return the (quota, client) it counts against, or None if it is not limited.
+
+    Aborts with 401 when an API route is called without a valid key.
+    """
+    endpoint = request.endpoint
+    if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+        return None
+    if endpoint in PUBLIC_ENDPOINTS:
+        return _default_quota, request.remote_addr or '127.0.0.1'
+
+    api_key = request.headers.get(API_KEY_HEADER) or request.args.get('api_key')
+    if not api_key or api_key not in api_keys:
+        abort(401, description="Unauthorized: Valid API key required.")
+    quota = _route_quotas.get(endpoint)
+    if quota is None:
+        quota = _route_quotas[endpoint] = Quota(endpoint, ROUTE_LIMITS.get(endpoint, ROUTE_LIMIT), 60 * 60)
+    return quota, api_key
+
+def check_key(key):
+    """Abort with 404 unless key is a content key."""
+    if key not in ALL_KEYS:
+        abort(404, description=f"Invalid key '{key}'. Use /api/v1/content to see available keys.")
+
+def parse_keys(value):
+    """Parse a comma-separated list of content keys, aborting with 404 on an unknown key."""
+    keys = list(dict.fromkeys(key.strip() for key in value.split(',') if key.strip()))
+    if not keys:
+        abort(404, description="No keys requested. Use /api/v1/content to see available keys.")
+    for key in keys:
+        check_key(key)
+    return keys
+
+def parse_date(value, name='date'):
+    """Parse a YYYY-MM-DD request value, aborting with 400 if it is malformed."""
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        abort(400, description=f"Invalid {name} '{value}'. Use the YYYY-MM-DD format.")
+
+def archive_range(args):
+    """Return the (start, end) dates of an archive export, from ?year= or ?from=&to=."""
+    if 'year' in args:
+        try:
+            return liturgical_year_range(int(args['year']))
+        except ValueError:
+            abort(400, description=f"Invalid year '{args['year']}'.")
+    return parse_date(args.get('from'), 'from'), parse_date(args.get('to'), 'to')
+
+def reading_matches(reference, find_reading_dates):
+    """Return the JSON body listing the days a scripture reference was read, aborting with 400 if it is invalid."""
+    matches = find_reading_dates(reference) if reference else None
+    if matches is None:
+        abort(400, description=f"Invalid scripture reference '{reference}'. Use e.g. ?ref=John 3:16.")
+    return {
+        'reference': reference,
+        'readings': [
+            {'key': key, 'date': day.isoformat(), 'reading': reading, 'citation': citation}
+            for key, day, reading, citation in matches
+        ],
+    }
+
+def content_response(request, response_class, responses, age):
+    """Serve a precomputed content response, honouring Accept-Encoding and conditional GETs.
+
+    The content age in seconds is reported in the Age header.
+    """
+    last_modified = int(time.time() - age)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(responses['etag'])
+    else:
+        not_modified = bool(request.if_modified_since) and request.if_modified_since.timestamp() >= last_modified
+
+    if not_modified:
+        response = response_class(status=304)
+    else:
+        encodings = [encoding for encoding in ('br', 'gzip') if encoding in responses]
+        encoding = request.accept_encodings.best_match(encodings)
+        response = response_class(responses[encoding or 'identity'], mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(responses['etag'])
+    response.last_modified = last_modified
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Age'] = str(int(age))
+    return response
+
+def documentation_endpoints(url_for, updates=False):
+    """List the endpoints shown on the documentation page, with the update feed if the app serves it."""
+    endpoints = []
+    for key, source in SOURCES.items():
+        endpoint = {
+            'key': key,
+            'url': url_for('get_content', key=key, _external=True),
+            'description': source.description,
+            'example_request': f'GET {url_for("get_content", key=key, _external=True)}?api_key=YOUR_API_KEY',
+        }
+        endpoints.append(endpoint)
+
+    # Add the batch endpoint
+    endpoints.append({
+        'key': 'batch',
+        'url': url_for('get_content_keys', _external=True),
+        'description': 'Get the content for several keys in one request.',
+        'example_request': f'GET {url_for("get_content_keys", _external=True)}?keys=daily_readings,saint_of_the_day,mass_reading_details&api_key=YOUR_API_KEY',
+    })
+
+    # Add the reading search endpoint
+    endpoints.append({
+        'key': 'readings',
+        'url': url_for('search_readings', _external=True),
+        'description': 'Find the archived days on which a scripture passage was read.',
+        'example_request': f'GET {url_for("search_readings", _external=True)}?ref=John 3:16&api_key=YOUR_API_KEY',
+    })
+
+    if updates:
+        endpoints.append({
+            'key': 'updates',
+            'url': url_for('stream_updates', _external=True),
+            'description': 'Receive a Server-Sent Event whenever the content of a key changes, instead of polling it.',
+            'example_request': f'GET {url_for("stream_updates", _external=True)}?keys=daily_readings&api_key=YOUR_API_KEY',
+        })
+        endpoints.append({
+            'key': 'updates_poll',
+            'url': url_for('poll_updates', _external=True),
+            'description': 'Long-poll for content changes: send back the cursor of the last response to wait for the next change.',
+            'example_request': f'GET {url_for("poll_updates", _external=True)}?keys=daily_readings&cursor=CURSOR&api_key=YOUR_API_KEY',
+        })
+    return endpoints
@@ -1,41 +1,47 @@
 # app.py
 
-import os
-from flask import Flask, jsonify, abort, request, render_template, url_for
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-from redis_client import redis_client
-from scraper import scrape_content, URLS, scrape_mass_reading_details
-from storage import load_data, save_data, is_data_valid
+from flask import Flask, Response, g, jsonify, abort, request, render_template, url_for, stream_with_context
+from scraper import scrape_content
+from sources import SOURCES, ALL_KEYS, source_ttls
+from storage import store, get_data, get_many_data, fill_in_data
+from metrics import REQUEST_LATENCY, render_metrics
+from quota import check_quota
+from archive import can_fill_in, content_date, export_archive, find_reading_dates, load_archived
+from api_common import (
+    load_api_keys, request_quota, check_key, parse_keys, parse_date, archive_range,
+    reading_matches, content_response, documentation_endpoints,
+)
+import json
 import time
 
 app = Flask(__name__)
 
-# Maximum age for data in seconds (e.g., 1 day)
-MAX_DATA_AGE = 12 * 60 * 60  # 12 hours
-
 # Load API keys from environment variable
-API_KEYS = set(os.getenv('API_KEYS', '').split(','))
-API_KEYS = {key.strip() for key in API_KEYS if key.strip()}
-if not API_KEYS:
-    raise ValueError("No API keys set. Please set the 'API_KEYS' environment variable.")
-
-# Construct Redis URI for Limiter
-REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', '')
-REDIS_HOST = os.getenv('REDIS_HOST', 'srv-captain--redis-rate-limiter')
-REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
-if REDIS_PASSWORD:
-    REDIS_URI = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0"
-else:
-    REDIS_URI = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
-
-# Initialize Limiter with Redis storage
-limiter = Limiter(
-    app=app,
-    key_func=get_remote_address,
-    default_limits=["100 per hour"],
-    storage_uri=REDIS_URI
-)
+API_KEYS = load_api_keys()
+
+@app.before_request
+def start_request():
+    g.request_start = time.perf_counter()
+    # Every route is authenticated and rate limited here, per API key
+    limited = request_quota(request, API_KEYS)
+    if limited and not check_quota(store, *limited):
+        abort(429)
+
+@app.after_request
+def record_request_latency(response):
+    if 'request_start' in g:
+        REQUEST_LATENCY.labels(
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code,
+        ).observe(time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose metrics in the Prometheus text format."""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
 
 # Error handler for rate limit errors
 @app.errorhandler(429)
@@ -46,91 +52,96 @@ def ratelimit_handler(e):
 @app.route('/', methods=['GET'])
 def api_documentation():
     """Render API documentation as HTML."""
-    endpoints = []
-    for key in URLS.keys():
-        endpoint = {
-            'key': key,
-            'url': url_for('get_content', key=key, _external=True),
-            'description': f'Get the {key.replace("_", " ")} content.',
-            'example_request': f'GET {url_for("get_content", key=key, _external=True)}?api_key=YOUR_API_KEY',
-        }
-        endpoints.append(endpoint)
-    
-    # Add mass_reading_details endpoint
-    endpoints.append({
-        'key': 'mass_reading_details',
-        'url': url_for('get_mass_reading_details', _external=True),
-        'description': 'Get the mass reading details.',
-        'example_request': f'GET {url_for("get_mass_reading_details", _external=True)}?api_key=YOUR_API_KEY',
-    })
-    
+    endpoints = documentation_endpoints(url_for)
     return render_template('index.html', endpoints=endpoints)
 
 @app.route('/api/v1/content', methods=['GET'])
-@limiter.limit("50 per hour")
 def get_content_keys():
-    """Get the list of available content keys."""
-    api_key = request.args.get('api_key')
-    if not api_key or api_key not in API_KEYS:
-        abort(401, description="Unauthorized: Valid API key required.")
-    
-    keys = list(URLS.keys()) + ['mass_reading_details']
-    return jsonify({'keys': keys}), 200
+    """Get the list of available content keys, or the content for several keys with ?keys=a,b,c."""
+    if 'keys' not in request.args:
+        return jsonify({'keys': ALL_KEYS}), 200
+
+    # Batch request: resolve every requested key in one round trip
+    requested = parse_keys(request.args['keys'])
+
+    scrapes = {key: lambda key=key: scrape_content(key, store) for key in requested}
+    results = get_many_data(store, scrapes, source_ttls(requested))
+    content = {key: results[key][0] for key in requested}
+    errors = {key: f"Failed to scrape content for key '{key}'" for key in requested if not content[key]}
+
+    body = {'content': content}
+    if errors:
+        body['errors'] = errors
+    response = jsonify(body)
+    ages = [age for _, age, _ in results.values() if age is not None]
+    if ages:
+        response.headers['Age'] = str(int(max(ages)))
+    return response, 200
 
 @app.route('/api/v1/content/<string:key>', methods=['GET'])
-@limiter.limit("50 per hour")
 def get_content(key):
     """Get the content for a given key, triggering a scrape if necessary."""
-    api_key = request.args.get('api_key')
-    if not api_key or api_key not in API_KEYS:
-        abort(401, description="Unauthorized: Valid API key required.")
-    
     # Check if the key is valid
-    if key not in URLS and key != 'mass_reading_details':
-        abort(404, description=f"Invalid key '{key}'. Use /api/v1/content to see available keys.")
+    check_key(key)
+    source = SOURCES[key]
+    
+    # Stale data is served while it is refreshed; missing data is scraped now
+    content, age, responses = get_data(store, key, lambda: scrape_content(key, store), source.ttl, source.stale_ttl)
+    if not content:
+        abort(500, description=f"Failed to scrape content for key '{key}'")
     
-    # Handle mass_reading_details separately
-    if key == 'mass_reading_details':
-        return get_mass_reading_details()
+    return content_response(request, Response, responses, age)
+
+@app.route('/api/v1/content/<string:key>/<string:day>', methods=['GET'])
+def get_content_for_date(key, day):
+    """Get the archived content for a given key and date."""
+    # Check if the key is valid
+    check_key(key)
+    day = parse_date(day)
     
-    # Check if the data is valid
-    if not is_data_valid(redis_client, key, MAX_DATA_AGE):
-        # Data is missing or outdated; trigger scraping
-        content = scrape_content(key)
-        if content:
-            save_data(redis_client, key, content)
-        else:
-            abort(500, description=f"Failed to scrape content for key '{key}'")
-    else:
-        content = load_data(redis_client, key)
+    content = load_archived(key, day)
+    if content is None and day == content_date(key):
+        # Current content saved before the archive existed
+        source = SOURCES[key]
+        content, _, _ = get_data(store, key, lambda: scrape_content(key, store), source.ttl, source.stale_ttl)
+    elif content is None and can_fill_in(key, day):
+        # Sources with dated pages (such as universalis) can fill in missing days near today
+        content = fill_in_data(store, key, day, lambda: scrape_content(key, day=day))
+    if not content:
+        abort(404, description=f"No '{key}' content archived for {day.isoformat()}.")
     
     return jsonify({'content': content}), 200
 
+@app.route('/api/v1/archive', methods=['GET'])
+def export_content_archive():
+    """Stream archived content as JSON lines, for a liturgical year (?year=) or a date range (?from=&to=)."""
+    start, end = archive_range(request.args)
+    keys = [key.strip() for key in request.args.get('keys', '').split(',') if key.strip()]
+
+    def generate():
+        for key, day, content in export_archive(start, end, keys):
+            yield json.dumps({'key': key, 'date': day.isoformat(), 'content': content}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/v1/readings', methods=['GET'])
+def search_readings():
+    """Find the archived days on which a scripture passage was read (?ref=John 3:16)."""
+    return jsonify(reading_matches(request.args.get('ref'), find_reading_dates)), 200
+
 @app.route('/api/v1/mass_reading_details', methods=['GET'])
-@limiter.limit("50 per hour")
 def get_mass_reading_details():
     """Get the mass reading details."""
-    api_key = request.args.get('api_key')
-    if not api_key or api_key not in API_KEYS:
-        abort(401, description="Unauthorized: Valid API key required.")
-    
-    # Check if the data is valid
-    if not is_data_valid(redis_client, 'mass_reading_details', MAX_DATA_AGE):
-        # Data is missing or outdated; trigger scraping
-        content = scrape_mass_reading_details()
-        if content:
-            save_data(redis_client, 'mass_reading_details', content)
-        else:
-            abort(500, description="Failed to scrape mass reading details")
-    else:
-        content = load_data(redis_client, 'mass_reading_details')
-    
-    return jsonify({'content': content}), 200
+    return get_content('mass_reading_details')
 
 @app.errorhandler(404)
 def resource_not_found(e):
     return jsonify(error=str(e.description)), 404
 
+@app.errorhandler(400)
+def bad_request(e):
+    return jsonify(error=str(e.description)), 400
+
 @app.errorhandler(401)
 def unauthorized(e):
     return jsonify(error=str(e.description)), 401
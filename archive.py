@@ -0,0 +1,188 @@
+# archive.py
+
+import os
+import json
+import zlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from scripture import parse_reference
+from sources import SOURCES
+
+# Past content is kept on disk, one zlib-compressed row per key and date,
+# so Redis only ever holds the current content for each key
+ARCHIVE_PATH = os.getenv('ARCHIVE_PATH', 'archive.sqlite3')
+# Keys whose content is structured mass readings, indexed for lookups by reference
+READING_KEYS = [key for key, source in SOURCES.items() if source.parser == 'mass_readings']
+# Days before and after a source's current content date for which a missing
+# archive entry is scraped from its dated pages on request
+FILL_IN_DAYS_BACK = int(os.getenv('FILL_IN_DAYS_BACK', '366'))
+FILL_IN_DAYS_AHEAD = int(os.getenv('FILL_IN_DAYS_AHEAD', '31'))
+
+# Bumped when the reading_index rows change for the same archive, such as
+# when scripture.BOOKS learns new names, so existing archives are re-indexed
+READING_INDEX_VERSION = 2
+
+# SQLite connections cannot be shared between threads
+_local = threading.local()
+# The schema is set up by the first connection of each process
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+# Archive writes run on one long-lived thread per process, so they share one
+# connection and never hold up a request
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive')
+
+def get_connection():
+    """Return this thread's archive connection, creating the archive if needed."""
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(ARCHIVE_PATH, timeout=10)
+        create_schema(connection)
+        _local.connection = connection
+    return connection
+
+def create_schema(connection):
+    """Create the archive and its reading index, once per process."""
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS archive ('
+            'key TEXT NOT NULL, date TEXT NOT NULL, content BLOB NOT NULL, '
+            'PRIMARY KEY (key, date)) WITHOUT ROWID'
+        )
+        create_reading_index(connection)
+        _schema_ready = True
+
+def create_reading_index(connection):
+    """Create the index of archived reading verse ranges, rebuilding one from an older READING_INDEX_VERSION."""
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(reading_index)')]
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    rebuild = bool(columns) and ('key' not in columns or version < READING_INDEX_VERSION)
+    with connection:
+        if rebuild:
+            connection.execute('DROP TABLE reading_index')
+        # Verse ranges of the archived mass readings, for lookups by reference
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS reading_index ('
+            'book TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL, '
+            'key TEXT NOT NULL, date TEXT NOT NULL, reading TEXT NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS reading_index_book ON reading_index (book, start)')
+        connection.execute('DROP INDEX IF EXISTS reading_index_date')
+        connection.execute('CREATE INDEX IF NOT EXISTS reading_index_key_date ON reading_index (key, date)')
+        if rebuild and READING_KEYS:
+            rows = connection.execute(
+                f"SELECT key, date, content FROM archive WHERE key IN ({', '.join('?' for _ in READING_KEYS)})",
+                READING_KEYS,
+            ).fetchall()
+            for key, day, blob in rows:
+                data = json.loads(zlib.decompress(blob))
+                if isinstance(data, dict):
+                    connection.executemany(
+                        'INSERT INTO reading_index (book, start, end, key, date, reading) VALUES (?, ?, ?, ?, ?, ?)',
+                        reading_rows(key, date.fromisoformat(day), data),
+                    )
+        connection.execute(f'PRAGMA user_version = {READING_INDEX_VERSION}')
+
+def content_date(key, now=None):
+    """Return the date the current content for key belongs to, in its source's timezone."""
+    source = SOURCES[key]
+    today = (now or datetime.now(source.timezone)).date()
+    if source.content_date == 'next_sunday':
+        # Monday is 0, so this is today on a Sunday
+        return today + timedelta(days=6 - today.weekday())
+    return today
+
+def can_fill_in(key, day):
+    """Tell whether key's content for day may be scraped from its source's dated pages when it is not archived."""
+    if not SOURCES[key].dated_url:
+        return False
+    today = content_date(key)
+    return today - timedelta(days=FILL_IN_DAYS_BACK) <= day <= today + timedelta(days=FILL_IN_DAYS_AHEAD)
+
+# Mass reading fields that hold a scripture reference
+INDEXED_READINGS = ('first_reading', 'psalm', 'second_reading', 'gospel_acclamation', 'gospel')
+
+def reading_rows(key, day, data):
+    """Return the reading_index rows for one day's mass reading details under key."""
+    rows = []
+    for reading in INDEXED_READINGS:
+        reference = parse_reference(data.get(reading))
+        if reference:
+            book, ranges = reference
+            rows += [(book, start, end, key, day.isoformat(), reading) for start, end in ranges]
+    return rows
+
+def archive_data(key, day, data):
+    """Store data for key on the given date, replacing anything already stored."""
+    blob = zlib.compress(json.dumps(data).encode('utf-8'))
+    connection = get_connection()
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO archive (key, date, content) VALUES (?, ?, ?)',
+            (key, day.isoformat(), blob),
+        )
+        if key in READING_KEYS and isinstance(data, dict):
+            connection.execute('DELETE FROM reading_index WHERE key = ? AND date = ?', (key, day.isoformat()))
+            connection.executemany(
+                'INSERT INTO reading_index (book, start, end, key, date, reading) VALUES (?, ?, ?, ?, ?, ?)',
+                reading_rows(key, day, data),
+            )
+
+def load_archived(key, day):
+    """Load the data stored for key on the given date, or None."""
+    row = get_connection().execute(
+        'SELECT content FROM archive WHERE key = ? AND date = ?', (key, day.isoformat())
+    ).fetchone()
+    if row:
+        return json.loads(zlib.decompress(row[0]))
+    return None
+
+def export_archive(start, end, keys=None):
+    """Yield (key, date, data) for every archived entry from start to end inclusive, in date order."""
+    query = 'SELECT key, date, content FROM archive WHERE date BETWEEN ? AND ?'
+    params = [start.isoformat(), end.isoformat()]
+    if keys:
+        query += f" AND key IN ({', '.join('?' for _ in keys)})"
+        params += list(keys)
+    query += ' ORDER BY date, key'
+    for key, day, blob in get_connection().execute(query, params):
+        yield key, date.fromisoformat(day), json.loads(zlib.decompress(blob))
+
+def find_reading_dates(reference):
+    """Return [(key, date, reading, citation)] for every archived reading overlapping a scripture reference, newest first.
+
+    Returns None if the reference cannot be parsed.
+    """
+    parsed = parse_reference(reference)
+    if parsed is None:
+        return None
+    book, ranges = parsed
+    matches = {}
+    connection = get_connection()
+    for start, end in ranges:
+        rows = connection.execute(
+            'SELECT key, date, reading FROM reading_index WHERE book = ? AND start <= ? AND end >= ?',
+            (book, end, start),
+        )
+        for key, day, reading in rows:
+            matches[(day, key, reading)] = None
+    results = []
+    for day, key, reading in sorted(matches, reverse=True):
+        details = load_archived(key, date.fromisoformat(day)) or {}
+        results.append((key, date.fromisoformat(day), reading, details.get(reading)))
+    return results
+
+def first_sunday_of_advent(year):
+    """Return the first Sunday of Advent in the given calendar year (between 27 November and 3 December)."""
+    december_3 = date(year, 12, 3)
+    return december_3 - timedelta(days=(december_3.weekday() + 1) % 7)
+
+def liturgical_year_range(year):
+    """Return the first and last day of the liturgical year that ends in the given calendar year."""
+    return first_sunday_of_advent(year - 1), first_sunday_of_advent(year) - timedelta(days=1)
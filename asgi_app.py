@@ -0,0 +1,228 @@
+# asgi_app.py
+#
+# Async variant of app.py with the same routes and responses. Redis and
+# upstream I/O are non-blocking, so a few processes can hold thousands of
+# concurrent requests. It also serves the update feed (/api/v1/updates),
+# which holds connections open and so is only offered here. Run it with an
+# ASGI server, for example:
+#
+#   hypercorn --bind 0.0.0.0:5000 --workers 2 asgi_app:app
+
+import json
+import time
+from quart import Quart, Response, g, jsonify, abort, request, render_template, url_for
+from werkzeug.exceptions import HTTPException
+from sources import SOURCES, ALL_KEYS, source_ttls
+from async_scraper import scrape_content
+from async_storage import get_data, get_many_data, fill_in_data, run_archive
+from backends import create_async_backend
+import storage
+from metrics import REQUEST_LATENCY, render_metrics
+from quota import check_quota_async
+from feed import UpdateFeed, HEARTBEAT_INTERVAL, LONG_POLL_TIMEOUT, MAX_LONG_POLL_TIMEOUT, versions_cursor, sse_event
+from archive import can_fill_in, content_date, export_archive, find_reading_dates, load_archived
+from api_common import (
+    load_api_keys, request_quota, check_key, parse_keys, parse_date, archive_range,
+    reading_matches, content_response, documentation_endpoints,
+)
+
+app = Quart(__name__)
+
+# Load API keys from environment variable
+API_KEYS = load_api_keys()
+
+# Async view of the store picked by STORAGE_BACKEND
+store = create_async_backend(storage.store)
+
+# Content versions for the update feed, followed by one task in this process
+feed = UpdateFeed(store, ALL_KEYS)
+
+@app.before_request
+async def start_request():
+    g.request_start = time.perf_counter()
+    # Every route is authenticated and rate limited here, per API key
+    limited = request_quota(request, API_KEYS)
+    if limited and not await check_quota_async(store, *limited):
+        abort(429)
+
+@app.after_request
+async def record_request_latency(response):
+    if 'request_start' in g:
+        REQUEST_LATENCY.labels(
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code,
+        ).observe(time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Expose metrics in the Prometheus text format."""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+# Root URL with HTML documentation
+@app.route('/', methods=['GET'])
+async def api_documentation():
+    """Render API documentation as HTML."""
+    return await render_template('index.html', endpoints=documentation_endpoints(url_for, updates=True))
+
+@app.route('/api/v1/content', methods=['GET'])
+async def get_content_keys():
+    """Get the list of available content keys, or the content for several keys with ?keys=a,b,c."""
+    if 'keys' not in request.args:
+        return jsonify({'keys': ALL_KEYS}), 200
+
+    # Batch request: resolve every requested key in one round trip
+    requested = parse_keys(request.args['keys'])
+    scrapes = {key: lambda key=key: scrape_content(key, store) for key in requested}
+    results = await get_many_data(store, scrapes, source_ttls(requested))
+    content = {key: results[key][0] for key in requested}
+    errors = {key: f"Failed to scrape content for key '{key}'" for key in requested if not content[key]}
+
+    body = {'content': content}
+    if errors:
+        body['errors'] = errors
+    response = jsonify(body)
+    ages = [age for _, age, _ in results.values() if age is not None]
+    if ages:
+        response.headers['Age'] = str(int(max(ages)))
+    return response, 200
+
+@app.route('/api/v1/content/<string:key>', methods=['GET'])
+async def get_content(key):
+    """Get the content for a given key, triggering a scrape if necessary."""
+    check_key(key)
+    source = SOURCES[key]
+    
+    # Stale data is served while it is refreshed; missing data is scraped now
+    content, age, responses = await get_data(store, key, lambda: scrape_content(key, store), source.ttl, source.stale_ttl)
+    if not content:
+        abort(500, description=f"Failed to scrape content for key '{key}'")
+    
+    return content_response(request, Response, responses, age)
+
+@app.route('/api/v1/content/<string:key>/<string:day>', methods=['GET'])
+async def get_content_for_date(key, day):
+    """Get the archived content for a given key and date."""
+    check_key(key)
+    day = parse_date(day)
+    
+    content = await run_archive(load_archived, key, day)
+    if content is None and day == content_date(key):
+        # Current content saved before the archive existed
+        source = SOURCES[key]
+        content, _, _ = await get_data(store, key, lambda: scrape_content(key, store), source.ttl, source.stale_ttl)
+    elif content is None and can_fill_in(key, day):
+        # Sources with dated pages (such as universalis) can fill in missing days near today
+        content = await fill_in_data(store, key, day, lambda: scrape_content(key, day=day))
+    if not content:
+        abort(404, description=f"No '{key}' content archived for {day.isoformat()}.")
+    
+    return jsonify({'content': content}), 200
+
+@app.route('/api/v1/archive', methods=['GET'])
+async def export_content_archive():
+    """Stream archived content as JSON lines, for a liturgical year (?year=) or a date range (?from=&to=)."""
+    start, end = archive_range(request.args)
+    keys = [key.strip() for key in request.args.get('keys', '').split(',') if key.strip()]
+
+    # Rows are read in batches on the archive thread
+    rows = export_archive(start, end, keys)
+    def next_batch():
+        batch = []
+        for key, day, content in rows:
+            batch.append(json.dumps({'key': key, 'date': day.isoformat(), 'content': content}) + '\n')
+            if len(batch) == 100:
+                break
+        return ''.join(batch)
+
+    async def generate():
+        while True:
+            chunk = await run_archive(next_batch)
+            if not chunk:
+                break
+            yield chunk
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/v1/readings', methods=['GET'])
+async def search_readings():
+    """Find the archived days on which a scripture passage was read (?ref=John 3:16)."""
+    body = await run_archive(reading_matches, request.args.get('ref'), find_reading_dates)
+    return jsonify(body), 200
+
+@app.route('/api/v1/mass_reading_details', methods=['GET'])
+async def get_mass_reading_details():
+    """Get the mass reading details."""
+    return await get_content('mass_reading_details')
+
+@app.route('/api/v1/updates', methods=['GET'])
+async def stream_updates():
+    """Stream the version of each key (?keys=a,b, all by default) as Server-Sent Events whenever it changes.
+
+    The current versions are sent first. A version is the ETag of the key's
+    content, so a client fetches the content when its version changes,
+    instead of polling it.
+    """
+    keys = parse_keys(request.args['keys']) if 'keys' in request.args else ALL_KEYS
+    await feed.start()
+
+    async def events():
+        known = feed.current(keys)
+        yield 'retry: 5000\n\n'
+        for key, version in known.items():
+            yield sse_event('update', {'key': key, 'version': version})
+        while True:
+            current = await feed.wait_for_change(known, HEARTBEAT_INTERVAL)
+            if current is None:
+                yield ': keep-alive\n\n'
+                continue
+            for key, version in current.items():
+                if version != known[key]:
+                    yield sse_event('update', {'key': key, 'version': version})
+            known = current
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop proxies such as nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.timeout = None
+    return response
+
+@app.route('/api/v1/updates/poll', methods=['GET'])
+async def poll_updates():
+    """Long-poll for version changes of keys (?keys=a,b, all by default).
+
+    Without ?cursor= the current versions are returned at once. With the
+    cursor of an earlier response, the request waits up to ?timeout=
+    seconds for a change and returns the new versions, or 204 if there was none.
+    """
+    keys = parse_keys(request.args['keys']) if 'keys' in request.args else ALL_KEYS
+    try:
+        timeout = min(float(request.args.get('timeout', LONG_POLL_TIMEOUT)), MAX_LONG_POLL_TIMEOUT)
+    except ValueError:
+        abort(400, description=f"Invalid timeout '{request.args['timeout']}'.")
+    await feed.start()
+
+    versions = feed.current(keys)
+    if request.args.get('cursor') == versions_cursor(versions):
+        versions = await feed.wait_for_change(versions, timeout)
+        if versions is None:
+            return Response(status=204)
+    return jsonify({'versions': versions, 'cursor': versions_cursor(versions)}), 200
+
+@app.after_serving
+async def stop_feed():
+    await feed.stop()
+
+@app.errorhandler(HTTPException)
+async def http_error(e):
+    if e.code == 429:
+        return jsonify(error="Rate limit exceeded. Please try again later."), 429
+    if e.code in (400, 401, 404, 500):
+        return jsonify(error=str(e.description)), e.code
+    return e
+
+if __name__ == '__main__':
+    app.run(debug=True, host='0.0.0.0', port=5000)
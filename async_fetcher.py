@@ -0,0 +1,49 @@
+# async_fetcher.py
+
+import asyncio
+import httpx
+from redis_client import redis_available
+from fetcher import TIMEOUT, RETRIES, conditional_headers, response_validators
+
+# Status codes worth retrying, with the same backoff as the sync fetcher
+RETRY_STATUSES = set(RETRIES.status_forcelist)
+
+_client = None
+
+def get_client():
+    """Return this process's pooled async HTTP client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0]),
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+            transport=httpx.AsyncHTTPTransport(retries=RETRIES.total),
+            follow_redirects=True,
+        )
+    return _client
+
+async def fetch(url, store=None):
+    """Async version of fetcher.fetch, using an async store.
+
+    Returns the response, or None if upstream replied 304 Not Modified.
+    Raises httpx.HTTPError on failure.
+    """
+    if store is not None and not redis_available():
+        # Fetch unconditionally rather than wait on an unreachable Redis
+        store = None
+    headers = {}
+    if store is not None:
+        headers = conditional_headers(await store.load_validators(url))
+
+    for attempt in range(RETRIES.total + 1):
+        response = await get_client().get(url, headers=headers)
+        if response.status_code not in RETRY_STATUSES or attempt == RETRIES.total:
+            break
+        await asyncio.sleep(RETRIES.backoff_factor * (2 ** attempt))
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+
+    if store is not None:
+        await store.save_validators(url, response_validators(response.headers))
+    return response
@@ -0,0 +1,52 @@
+# async_scraper.py
+#
+# Async versions of the scraper.py entry points. Pages are fetched with the
+# async HTTP client; parsing is CPU-bound and runs in a worker thread.
+
+import asyncio
+import httpx
+import async_storage
+from async_fetcher import fetch
+from metrics import track_scrape
+from sources import SOURCES, ALL_KEYS, source_url
+from scraper import parse_page
+
+async def fetch_page(url, key, store=None):
+    """Async version of scraper.fetch_page."""
+    response = await fetch(url, store)
+    if response is not None:
+        return response, None
+
+    previous = await async_storage.load_data(store, key)
+    if previous:
+        print(f"{url} has not changed")
+        return None, previous
+    # Nothing saved to fall back on; fetch the page again unconditionally
+    return await fetch(url), None
+
+@track_scrape()
+async def scrape_content(key, store=None, day=None):
+    """Async version of scraper.scrape_content."""
+    source = SOURCES.get(key)
+    if source is None:
+        print(f"Invalid key '{key}'. Valid keys are: {', '.join(ALL_KEYS)}")
+        return None
+
+    url = source_url(source, day)
+    if url is None:
+        print(f"No dated pages for '{key}'")
+        return None
+    if day:
+        # Conditional fetches only apply to the current saved content
+        store = None
+
+    print(f"Scraping {url}...")
+    try:
+        response, previous = await fetch_page(url, key, store)
+    except httpx.HTTPError as e:
+        print(f"Error fetching content: {e}")
+        return None
+
+    if response is None:
+        return previous
+    return await asyncio.to_thread(parse_page, key, response.content)
@@ -0,0 +1,239 @@
+# async_storage.py
+#
+# Async versions of the storage.py functions used on the request path, for
+# the async backends of backends.py. They share storage.py's per-process L1
+# cache and helpers, so the sync and async apps can run side by side.
+
+import time
+import asyncio
+from storage import (
+    LEASE_TIMEOUT, LEASE_WAIT, LEASE_POLL_INTERVAL,
+    _l1_cache, _l1_lock, _l1_lookup, _l1_revalidate, _l1_store,
+    _saved_entry, _archive, _split_by_age, _scraped_result, _hard_ttls, _local_entries, _local_result,
+    _fill_in_failed_recently, _record_fill_in,
+)
+from archive import archive_data, archive_executor, load_archived
+from redis_client import redis_available, mark_unavailable, UNAVAILABLE_ERRORS
+from metrics import track_storage
+
+# Keys with a background refresh running in this process
+_pending_refreshes = set()
+# Strong references to running refresh tasks so they are not garbage collected
+_refresh_tasks = set()
+# Store loads in flight, shared by the concurrent requests that need the same keys
+_loads_in_flight = {}
+
+@track_storage('save_data')
+async def save_data(store, key, data):
+    """Save data under the given key with a timestamp and precomputed response bodies. Returns the response bodies.
+
+    The bodies are compressed on a worker thread, like parse_page, so the event loop keeps serving.
+    """
+    entry, responses = await asyncio.to_thread(_saved_entry, key, data)
+    await store.save(key, entry, responses)
+    with _l1_lock:
+        _l1_cache.pop(key, None)
+    _archive(key, data)
+    return responses
+
+@track_storage('load_data')
+async def load_data(store, key):
+    """Load data for the given key from the store."""
+    entry = (await store.get([key]))[0]
+    if entry:
+        return entry['content']
+    return None
+
+@track_storage('load_entry')
+async def load_entry(store, key):
+    """Load data and its timestamp for the given key from the store. Returns (None, None) if missing."""
+    entry = (await store.get([key]))[0]
+    if entry:
+        return entry['content'], entry.get('timestamp', 0)
+    return None, None
+
+@track_storage('load_cached_entries')
+async def load_cached_entries(store, keys):
+    """Load several keys through the per-process cache, in at most two round trips to the store."""
+    now = time.monotonic()
+    entries, stale, missing = _l1_lookup(keys, now)
+    if not stale and not missing:
+        return entries
+
+    versions, loaded = await _shared_load(store, missing, list(stale))
+    if stale:
+        changed = _l1_revalidate(stale, versions, entries, now)
+        if changed:
+            loaded.update((await _shared_load(store, changed, []))[1])
+
+    _l1_store(loaded, entries, now)
+    return entries
+
+async def _shared_load(store, keys, check):
+    """store.load(keys, check=check), joining an identical load already in flight.
+
+    Unlike a sync worker, one process serves many requests at once, so every
+    request that finds the cache due a version check at the same moment
+    would otherwise make its own round trip for the same keys.
+    """
+    call = (tuple(keys), tuple(check))
+    future = _loads_in_flight.get(call)
+    if future is None:
+        future = asyncio.ensure_future(store.load(keys, check=check))
+        _loads_in_flight[call] = future
+        future.add_done_callback(lambda _: _loads_in_flight.pop(call, None))
+    # A cancelled request must not cancel the load for the others
+    versions, loaded = await asyncio.shield(future)
+    return versions, dict(loaded)
+
+async def acquire_lease(store, key):
+    """Try to take the scrape lease for key. Returns a token, or None if another worker holds it."""
+    return await store.acquire_lease(key, LEASE_TIMEOUT)
+
+async def release_lease(store, key, token):
+    """Release the scrape lease for key if it is still ours."""
+    await store.release_lease(key, token)
+
+async def _scrape_and_save(store, key, scrape, token):
+    """Await scrape() under an acquired lease and save the result. Returns (content, responses)."""
+    try:
+        content = await scrape()
+        if not content:
+            return None, None
+        return content, await save_data(store, key, content)
+    finally:
+        await release_lease(store, key, token)
+
+async def _reload_entry(store, key):
+    """Async version of storage._reload_entry."""
+    with _l1_lock:
+        _l1_cache.pop(key, None)
+    return (await load_cached_entries(store, [key]))[key]
+
+async def _fresh_entry(store, key, max_age_seconds):
+    """Async version of storage._fresh_entry."""
+    entry = await _reload_entry(store, key)
+    if entry[0] is not None and time.time() - entry[1] < max_age_seconds:
+        return entry
+    return None
+
+async def refresh_data(store, key, scrape, max_age_seconds):
+    """Scrape and save data for key, letting only one worker scrape at a time.
+
+    scrape is a coroutine function. Returns a (content, timestamp, responses) tuple.
+    """
+    token = await acquire_lease(store, key)
+    if token:
+        fresh = await _fresh_entry(store, key, max_age_seconds)
+        if fresh:
+            await release_lease(store, key, token)
+            return fresh
+        content, responses = await _scrape_and_save(store, key, scrape, token)
+        if content:
+            return content, time.time(), responses
+        return await _reload_entry(store, key)
+
+    # Another worker is scraping; poll its lease and read the entry once it is released
+    deadline = time.time() + LEASE_WAIT
+    while time.time() < deadline and await store.lease_held(key):
+        await asyncio.sleep(LEASE_POLL_INTERVAL)
+    return await _reload_entry(store, key)
+
+def schedule_refresh(store, key, scrape, max_age_seconds):
+    """Start a background refresh of key unless one is already running in this process."""
+    if key in _pending_refreshes:
+        return False
+    _pending_refreshes.add(key)
+
+    async def run():
+        try:
+            token = await acquire_lease(store, key)
+            if not token:
+                return
+            if await _fresh_entry(store, key, max_age_seconds):
+                # Another worker refreshed it since this one loaded the stale entry
+                await release_lease(store, key, token)
+            else:
+                await _scrape_and_save(store, key, scrape, token)
+        except Exception as e:
+            print(f"Error refreshing '{key}' in background: {e}")
+        finally:
+            _pending_refreshes.discard(key)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+    return True
+
+async def run_archive(fn, *args):
+    """Run a blocking archive (SQLite) call on the archive thread."""
+    return await asyncio.get_running_loop().run_in_executor(archive_executor, fn, *args)
+
+async def _archive_scraped(key, day, scrape):
+    content = await scrape()
+    if content:
+        await run_archive(archive_data, key, day, content)
+    return content
+
+async def fill_in_data(store, key, day, scrape):
+    """Async version of storage.fill_in_data; scrape is a coroutine function."""
+    if _fill_in_failed_recently(key, day):
+        return None
+    lease_key = f'{key}:{day:%Y%m%d}'
+    token = None
+    if redis_available():
+        try:
+            token = await acquire_lease(store, lease_key)
+        except UNAVAILABLE_ERRORS as e:
+            mark_unavailable(e)
+    if token:
+        try:
+            content = await run_archive(load_archived, key, day) or await _archive_scraped(key, day, scrape)
+        finally:
+            await release_lease(store, lease_key, token)
+    elif not redis_available():
+        content = await _archive_scraped(key, day, scrape)
+    else:
+        deadline = time.time() + LEASE_WAIT
+        try:
+            while time.time() < deadline and await store.lease_held(lease_key):
+                await asyncio.sleep(LEASE_POLL_INTERVAL)
+        except UNAVAILABLE_ERRORS as e:
+            mark_unavailable(e)
+        content = await run_archive(load_archived, key, day)
+    _record_fill_in(key, day, content)
+    return content
+
+async def get_data(store, key, scrape, soft_ttl, hard_ttl):
+    """Async version of storage.get_data; scrape is a coroutine function."""
+    return (await get_many_data(store, {key: scrape}, {key: (soft_ttl, hard_ttl)}))[key]
+
+async def get_many_data(store, scrapes, ttls):
+    """Async version of storage.get_many_data; each scrape is a coroutine function."""
+    if redis_available():
+        try:
+            return await _get_many_data(store, scrapes, ttls)
+        except UNAVAILABLE_ERRORS as e:
+            mark_unavailable(e)
+    return await get_local_data(scrapes, ttls)
+
+async def _get_many_data(store, scrapes, ttls):
+    entries = await load_cached_entries(store, list(scrapes))
+    results, to_refresh, to_scrape = _split_by_age(entries, ttls)
+    for key in to_refresh:
+        schedule_refresh(store, key, scrapes[key], ttls[key][0])
+
+    scraped = await asyncio.gather(*(refresh_data(store, key, scrapes[key], ttls[key][0]) for key in to_scrape))
+    for key, result in zip(to_scrape, scraped):
+        results[key] = _scraped_result(*result)
+    return results
+
+async def get_local_data(scrapes, ttls):
+    """Async version of storage.get_local_data; each scrape is a coroutine function."""
+    entries = _local_entries(scrapes)
+    results, _, to_scrape = _split_by_age(entries, _hard_ttls(ttls))
+    scraped = await asyncio.gather(*(scrapes[key]() for key in to_scrape))
+    for key, content in zip(to_scrape, scraped):
+        # Builds the response bodies of a scraped key; off the event loop as in save_data
+        results[key] = await asyncio.to_thread(_local_result, key, content, entries[key])
+    return results
@@ -0,0 +1,665 @@
+# backends.py
+#
+# Storage backends behind storage.py. A backend stores each key's entry
+# ({'content': ..., 'timestamp': ...}) with its precomputed response bodies
+# and a version that changes on every save. It also holds the scrape leases,
+# the upstream validators of fetcher.py and the shared quota buckets of
+# quota.py. STORAGE_BACKEND selects one:
+#
+#   redis   the shared Redis server (default)
+#   memory  a dict in this process, for tests and single-process deployments
+#   file    a memory-mapped append-only file at STORAGE_PATH, shared by the
+#           processes of one host
+#
+# Entries expire STORAGE_TTL seconds after they are saved. Saves are
+# announced to the update feed (feed.py): over Redis pub/sub, or for the
+# memory and file backends by polling poll_updates.
+
+import os
+import json
+import time
+import asyncio
+import uuid
+import mmap
+import fcntl
+import struct
+import threading
+from urllib.parse import quote
+from redis.client import NEVER_DECODE
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'redis')
+STORAGE_PATH = os.getenv('STORAGE_PATH', 'storage.log')
+# Long past any content's hard TTL, so expiry only clears out keys nobody asks for any more
+STORAGE_TTL = int(os.getenv('STORAGE_TTL', str(7 * 24 * 60 * 60)))
+
+# Key prefixes of the Redis bookkeeping stored next to the entries
+INTERNAL_PREFIXES = ('lease:', 'version:', 'response:', 'validators:', 'quota:')
+# Redis pub/sub channel on which every save publishes the saved key
+UPDATES_CHANNEL = 'updates'
+# How often the memory and file backends are polled for saves, and how long
+# a read of the Redis channel waits, in seconds
+UPDATE_POLL_INTERVAL = 1.0
+
+class Backend:
+    """The operations storage.py, fetcher.py and quota.py need from a backend.
+
+    Versions are strings. Entries without stored response bodies are loaded
+    with responses set to None.
+    """
+
+    def save(self, key, entry, responses):
+        """Store entry and its response bodies under key and change its version."""
+        raise NotImplementedError
+
+    def get(self, keys):
+        """Return the entry stored under each key, or None, as a list."""
+        raise NotImplementedError
+
+    def load(self, keys, check=()):
+        """Load several keys together with the versions of the keys in check.
+
+        Returns (versions, loaded): versions lists the current version of
+        each key in check, and loaded maps each key in keys to
+        (content, timestamp, responses, version), or None if it is missing.
+        """
+        raise NotImplementedError
+
+    def etags(self, keys):
+        """Return the ETag of each key's stored response bodies, or None, as a list, without loading the bodies."""
+        raise NotImplementedError
+
+    def keys(self):
+        """Iterate over the stored entry keys."""
+        raise NotImplementedError
+
+    def acquire_lease(self, key, timeout):
+        """Take the lease on key for up to timeout seconds. Returns a token, or None if it is held."""
+        raise NotImplementedError
+
+    def release_lease(self, key, token):
+        """Release the lease on key if token still holds it."""
+        raise NotImplementedError
+
+    def lease_held(self, key):
+        raise NotImplementedError
+
+    def load_validators(self, url):
+        """Return the validators stored for url by save_validators, or an empty dict."""
+        raise NotImplementedError
+
+    def save_validators(self, url, validators):
+        raise NotImplementedError
+
+    def take_tokens(self, name, capacity, rate, used):
+        """Refill the shared token bucket name, take used tokens from it and return the tokens left."""
+        raise NotImplementedError
+
+    def poll_updates(self):
+        """Return the keys saved since the last call, for the one update feed of this process.
+
+        Keys may be reported that did not change; the feed compares versions.
+        The Redis backend publishes saves on UPDATES_CHANNEL instead.
+        """
+        raise NotImplementedError
+
+# Redis
+
+# Delete the lease only if it is still held by the caller
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Refill the shared bucket, take the tokens used since the last sync and
+# return what is left. Tokens can go negative when workers overshoot, which
+# holds the client back until the debt is refilled.
+TAKE_TOKENS_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local used = tonumber(ARGV[4])
+local state = redis.call('hmget', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate) - used
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('expire', KEYS[1], math.ceil(capacity / rate))
+return tostring(tokens)
+"""
+
+def _queue_redis_save(pipe, key, entry, responses, ttl):
+    pipe.set(key, json.dumps(entry), ex=ttl)
+    pipe.delete(f'response:{key}')
+    pipe.hset(f'response:{key}', mapping=responses)
+    pipe.incr(f'version:{key}')
+    if ttl:
+        pipe.expire(f'response:{key}', ttl)
+        pipe.expire(f'version:{key}', ttl)
+    pipe.publish(UPDATES_CHANNEL, key)
+
+def _queue_redis_load(pipe, keys, check):
+    if check:
+        pipe.mget([f'version:{key}' for key in check])
+    for key in keys:
+        pipe.mget(key, f'version:{key}')
+        # Response bodies are binary, so they are read without decoding
+        pipe.execute_command('HGETALL', f'response:{key}', **{NEVER_DECODE: []})
+
+def _parse_redis_load(results, keys, check):
+    versions = results.pop(0) if check else []
+    loaded = {}
+    for index, key in enumerate(keys):
+        (value, version), stored_responses = results[index * 2], results[index * 2 + 1]
+        if not value:
+            loaded[key] = None
+            continue
+        entry = json.loads(value)
+        responses = None
+        if stored_responses:
+            responses = {field.decode(): body for field, body in stored_responses.items()}
+            responses['etag'] = responses['etag'].decode()
+        loaded[key] = (entry['content'], entry.get('timestamp', 0), responses, version)
+    return versions, loaded
+
+def _is_entry_key(key):
+    return not key.startswith(INTERNAL_PREFIXES)
+
+class RedisBackend(Backend):
+    """Entries in Redis, as JSON strings with a response:<key> hash and a version:<key> counter."""
+
+    def __init__(self, redis_client, ttl=STORAGE_TTL):
+        self.redis = redis_client
+        self.ttl = ttl
+
+    def save(self, key, entry, responses):
+        pipe = self.redis.pipeline()
+        _queue_redis_save(pipe, key, entry, responses, self.ttl)
+        pipe.execute()
+
+    def get(self, keys):
+        return [json.loads(value) if value else None for value in self.redis.mget(keys)]
+
+    def load(self, keys, check=()):
+        pipe = self.redis.pipeline(transaction=False)
+        _queue_redis_load(pipe, keys, check)
+        return _parse_redis_load(pipe.execute(), keys, check)
+
+    def etags(self, keys):
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(f'response:{key}', 'etag')
+        return pipe.execute()
+
+    def keys(self):
+        # SCAN walks the keyspace in batches instead of blocking Redis like KEYS
+        return (key for key in self.redis.scan_iter(count=1000) if _is_entry_key(key))
+
+    def acquire_lease(self, key, timeout):
+        token = uuid.uuid4().hex
+        if self.redis.set(f'lease:{key}', token, nx=True, ex=timeout):
+            return token
+        return None
+
+    def release_lease(self, key, token):
+        self.redis.eval(RELEASE_LEASE_SCRIPT, 1, f'lease:{key}', token)
+
+    def lease_held(self, key):
+        return bool(self.redis.exists(f'lease:{key}'))
+
+    def load_validators(self, url):
+        return self.redis.hgetall(f'validators:{url}')
+
+    def save_validators(self, url, validators):
+        pipe = self.redis.pipeline()
+        pipe.delete(f'validators:{url}')
+        if validators:
+            pipe.hset(f'validators:{url}', mapping=validators)
+        pipe.execute()
+
+    def take_tokens(self, name, capacity, rate, used):
+        return float(self.redis.eval(TAKE_TOKENS_SCRIPT, 1, f'quota:{name}', capacity, rate, time.time(), used))
+
+class AsyncRedisBackend:
+    """RedisBackend for a redis.asyncio client; every method is a coroutine."""
+
+    def __init__(self, redis_client, ttl=STORAGE_TTL):
+        self.redis = redis_client
+        self.ttl = ttl
+
+    async def save(self, key, entry, responses):
+        pipe = self.redis.pipeline()
+        _queue_redis_save(pipe, key, entry, responses, self.ttl)
+        await pipe.execute()
+
+    async def get(self, keys):
+        return [json.loads(value) if value else None for value in await self.redis.mget(keys)]
+
+    async def load(self, keys, check=()):
+        pipe = self.redis.pipeline(transaction=False)
+        _queue_redis_load(pipe, keys, check)
+        return _parse_redis_load(await pipe.execute(), keys, check)
+
+    async def etags(self, keys):
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(f'response:{key}', 'etag')
+        return await pipe.execute()
+
+    async def acquire_lease(self, key, timeout):
+        token = uuid.uuid4().hex
+        if await self.redis.set(f'lease:{key}', token, nx=True, ex=timeout):
+            return token
+        return None
+
+    async def release_lease(self, key, token):
+        await self.redis.eval(RELEASE_LEASE_SCRIPT, 1, f'lease:{key}', token)
+
+    async def lease_held(self, key):
+        return bool(await self.redis.exists(f'lease:{key}'))
+
+    async def load_validators(self, url):
+        return await self.redis.hgetall(f'validators:{url}')
+
+    async def save_validators(self, url, validators):
+        pipe = self.redis.pipeline()
+        pipe.delete(f'validators:{url}')
+        if validators:
+            pipe.hset(f'validators:{url}', mapping=validators)
+        await pipe.execute()
+
+    async def take_tokens(self, name, capacity, rate, used):
+        return float(await self.redis.eval(TAKE_TOKENS_SCRIPT, 1, f'quota:{name}', capacity, rate, time.time(), used))
+
+    async def updates(self):
+        """Yield the key of every save published on UPDATES_CHANNEL, by any process.
+
+        Reads wait UPDATE_POLL_INTERVAL at a time, inside the socket timeout.
+        """
+        pubsub = self.redis.pubsub()
+        try:
+            await pubsub.subscribe(UPDATES_CHANNEL)
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=UPDATE_POLL_INTERVAL)
+                if message:
+                    yield message['data']
+        finally:
+            await pubsub.aclose()
+
+# In memory
+
+class MemoryBackend(Backend):
+    """Entries in a dict of this process. Each process has its own, so leases and quotas are per process."""
+
+    def __init__(self, ttl=STORAGE_TTL):
+        self.ttl = ttl
+        # key -> (content, timestamp, responses, version, expires)
+        self._entries = {}
+        self._versions = {}
+        self._leases = {}
+        self._validators = {}
+        self._buckets = {}
+        self._updated = set()
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        stored = self._entries.get(key)
+        if stored and stored[4] is not None and stored[4] <= now:
+            del self._entries[key]
+            return None
+        return stored
+
+    def save(self, key, entry, responses):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            version = self._versions.get(key, 0) + 1
+            self._versions[key] = version
+            self._entries[key] = (entry['content'], entry.get('timestamp', 0), responses, str(version), expires)
+            self._updated.add(key)
+
+    def get(self, keys):
+        now = time.time()
+        with self._lock:
+            stored = [self._live(key, now) for key in keys]
+        return [{'content': item[0], 'timestamp': item[1]} if item else None for item in stored]
+
+    def load(self, keys, check=()):
+        now = time.time()
+        with self._lock:
+            versions = []
+            for key in check:
+                stored = self._live(key, now)
+                versions.append(stored[3] if stored else None)
+            loaded = {}
+            for key in keys:
+                stored = self._live(key, now)
+                loaded[key] = stored[:4] if stored else None
+        return versions, loaded
+
+    def etags(self, keys):
+        now = time.time()
+        with self._lock:
+            stored = [self._live(key, now) for key in keys]
+        return [item[2]['etag'] if item and item[2] else None for item in stored]
+
+    def keys(self):
+        now = time.time()
+        with self._lock:
+            return [key for key in list(self._entries) if self._live(key, now)]
+
+    def acquire_lease(self, key, timeout):
+        now = time.monotonic()
+        with self._lock:
+            held = self._leases.get(key)
+            if held and held[1] > now:
+                return None
+            token = uuid.uuid4().hex
+            self._leases[key] = (token, now + timeout)
+            return token
+
+    def release_lease(self, key, token):
+        with self._lock:
+            if self._leases.get(key, (None,))[0] == token:
+                del self._leases[key]
+
+    def lease_held(self, key):
+        with self._lock:
+            held = self._leases.get(key)
+            return bool(held) and held[1] > time.monotonic()
+
+    def load_validators(self, url):
+        return dict(self._validators.get(url, {}))
+
+    def save_validators(self, url, validators):
+        self._validators[url] = dict(validators)
+
+    def take_tokens(self, name, capacity, rate, used):
+        # Same arithmetic as TAKE_TOKENS_SCRIPT
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(name, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - updated) * rate) - used
+            self._buckets[name] = (tokens, now)
+        return tokens
+
+    def poll_updates(self):
+        with self._lock:
+            updated, self._updated = self._updated, set()
+        return updated
+
+# Memory-mapped file
+
+# Each record is a header length and a body length, a JSON header
+# {"key", "version", "expires", "etag", "bodies": [[name, length], ...]}
+# and the bodies back to back: the entry JSON first, then the response bodies.
+RECORD_HEADER = struct.Struct('<II')
+# The file is rewritten with only its live records once it is this large
+# and more than half of it is superseded or expired
+COMPACT_MIN_SIZE = 1024 * 1024
+
+class FileBackend(MemoryBackend):
+    """Entries appended to a memory-mapped file, shared by the processes on one host.
+
+    Every process indexes the file and reads entries straight from its
+    mapping. Writers append under an exclusive flock; the file is compacted
+    by replacing it, which readers notice by its inode. Leases are flocks on
+    per-key lock files, released if their holder dies. Quota buckets are kept
+    per process, as in MemoryBackend.
+    """
+
+    def __init__(self, path=STORAGE_PATH, ttl=STORAGE_TTL):
+        super().__init__(ttl)
+        self.path = path
+        self._fd = None
+        self._inode = None
+        self._map = None
+        # key -> (offset, header), for the latest record of each key
+        self._index = {}
+        self._scanned = 0
+        self._live_bytes = 0
+        self._lease_fds = {}
+        self._file_lock = threading.RLock()
+
+    # Index
+
+    def _open(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+        self._map = None
+        self._index = {}
+        self._scanned = 0
+        self._live_bytes = 0
+
+    def _refresh(self):
+        """Index any records appended since the last call, reopening the file if it was replaced."""
+        try:
+            replaced = self._fd is None or os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._open()
+        size = os.fstat(self._fd).st_size
+        if size == self._scanned:
+            return
+        self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+        offset = self._scanned
+        while offset + RECORD_HEADER.size <= size:
+            header_length, body_length = RECORD_HEADER.unpack_from(self._map, offset)
+            end = offset + RECORD_HEADER.size + header_length + body_length
+            if end > size:
+                # Partly written by a writer that died; the next writer truncates it
+                break
+            header = json.loads(self._map[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + header_length])
+            previous = self._index.get(header['key'])
+            if previous:
+                self._live_bytes -= previous[1]['length']
+            header['length'] = end - offset
+            self._index[header['key']] = (offset, header)
+            if _is_entry_key(header['key']):
+                self._updated.add(header['key'])
+            self._live_bytes += header['length']
+            offset = end
+        self._scanned = offset
+
+    def _read(self, key, now):
+        """Return the header and bodies of key's live record, or (None, None)."""
+        indexed = self._index.get(key)
+        if not indexed:
+            return None, None
+        offset, header = indexed
+        if header['expires'] is not None and header['expires'] <= now:
+            return None, None
+        position = offset + RECORD_HEADER.size + RECORD_HEADER.unpack_from(self._map, offset)[0]
+        bodies = {}
+        for name, length in header['bodies']:
+            bodies[name] = self._map[position:position + length]
+            position += length
+        return header, bodies
+
+    # Writes
+
+    def _append(self, key, entry, bodies, etag=None):
+        """Append a record for key under the file lock and return its version."""
+        with self._file_lock:
+            while True:
+                self._refresh()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                if os.stat(self.path).st_ino == self._inode:
+                    break
+                # Compacted by another process while we waited
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            try:
+                self._refresh()
+                if os.fstat(self._fd).st_size != self._scanned:
+                    os.truncate(self._fd, self._scanned)
+                previous = self._index.get(key)
+                version = previous[1]['version'] + 1 if previous else 1
+                record = self._record(key, version, entry, bodies, etag)
+                os.write(self._fd, record)
+                self._refresh()
+                if self._scanned >= COMPACT_MIN_SIZE and self._live_bytes * 2 < self._scanned:
+                    self._compact()
+            finally:
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            return version
+
+    def _record(self, key, version, entry, bodies, etag, expires=None):
+        if expires is None and self.ttl:
+            expires = time.time() + self.ttl
+        bodies = [(b'entry', json.dumps(entry).encode('utf-8'))] + [(name.encode(), body) for name, body in bodies]
+        header = json.dumps({
+            'key': key,
+            'version': version,
+            'expires': expires,
+            'etag': etag,
+            'bodies': [[name.decode(), len(body)] for name, body in bodies],
+        }).encode('utf-8')
+        body = b''.join(body for _, body in bodies)
+        return RECORD_HEADER.pack(len(header), len(body)) + header + body
+
+    def _compact(self):
+        """Rewrite the file with the latest live record of each key, under the file lock."""
+        now = time.time()
+        temporary = f'{self.path}.compact'
+        with open(temporary, 'wb') as compacted:
+            for key, (offset, header) in self._index.items():
+                if header['expires'] is None or header['expires'] > now:
+                    compacted.write(self._map[offset:offset + header['length']])
+        old_fd = self._fd
+        os.replace(temporary, self.path)
+        self._fd = None
+        self._refresh()
+        fcntl.flock(old_fd, fcntl.LOCK_UN)
+        os.close(old_fd)
+
+    # Backend
+
+    def save(self, key, entry, responses):
+        bodies = [(name, body) for name, body in responses.items() if name != 'etag']
+        self._append(key, entry, bodies, responses.get('etag'))
+
+    def get(self, keys):
+        now = time.time()
+        with self._file_lock:
+            self._refresh()
+            records = [self._read(key, now)[1] for key in keys]
+        return [json.loads(bodies['entry']) if bodies else None for bodies in records]
+
+    def load(self, keys, check=()):
+        now = time.time()
+        with self._file_lock:
+            self._refresh()
+            versions = []
+            for key in check:
+                header, _ = self._read(key, now)
+                versions.append(str(header['version']) if header else None)
+            loaded = {}
+            for key in keys:
+                header, bodies = self._read(key, now)
+                if header is None:
+                    loaded[key] = None
+                    continue
+                entry = json.loads(bodies.pop('entry'))
+                responses = dict(bodies, etag=header['etag']) if header['etag'] else None
+                loaded[key] = (entry['content'], entry.get('timestamp', 0), responses, str(header['version']))
+        return versions, loaded
+
+    def etags(self, keys):
+        # Read from the indexed record headers; the bodies are not touched
+        now = time.time()
+        with self._file_lock:
+            self._refresh()
+            headers = [self._index.get(key, (None, None))[1] for key in keys]
+        return [header['etag'] if header and (header['expires'] is None or header['expires'] > now) else None
+                for header in headers]
+
+    def keys(self):
+        now = time.time()
+        with self._file_lock:
+            self._refresh()
+            return [key for key, (_, header) in self._index.items()
+                    if _is_entry_key(key) and (header['expires'] is None or header['expires'] > now)]
+
+    def _lease_path(self, key):
+        # Lease names may hold characters that are not allowed in a file name, such as '/'
+        return f"{self.path}.lease-{quote(key, safe='')}"
+
+    def acquire_lease(self, key, timeout):
+        # The lock file outlives the lease; timeout is not needed as the OS drops the lock with its holder
+        fd = os.open(self._lease_path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        token = uuid.uuid4().hex
+        self._lease_fds[token] = fd
+        return token
+
+    def release_lease(self, key, token):
+        fd = self._lease_fds.pop(token, None)
+        if fd is not None:
+            os.close(fd)
+
+    def lease_held(self, key):
+        token = self.acquire_lease(key, 0)
+        if token is None:
+            return True
+        self.release_lease(key, token)
+        return False
+
+    def load_validators(self, url):
+        entry = self.get([f'validators:{url}'])[0]
+        return entry['content'] if entry else {}
+
+    def save_validators(self, url, validators):
+        self._append(f'validators:{url}', {'content': validators}, [])
+
+    def poll_updates(self):
+        # Records appended by any process are indexed, and so reported, here
+        with self._file_lock:
+            self._refresh()
+            updated, self._updated = self._updated, set()
+        return updated
+
+class AsyncBackend:
+    """Async interface to a MemoryBackend or FileBackend, whose calls do not wait on the network."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    async def updates(self):
+        """Yield the keys saved since the last poll, polling every UPDATE_POLL_INTERVAL seconds."""
+        while True:
+            for key in self.backend.poll_updates():
+                yield key
+            await asyncio.sleep(UPDATE_POLL_INTERVAL)
+
+def create_backend(name=STORAGE_BACKEND):
+    """Create the backend selected by name (STORAGE_BACKEND by default)."""
+    if name == 'redis':
+        from redis_client import redis_client
+        return RedisBackend(redis_client)
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'file':
+        return FileBackend()
+    raise ValueError(f"Unknown storage backend '{name}'. Use 'redis', 'memory' or 'file'.")
+
+def create_async_backend(backend):
+    """Create the async counterpart of backend, for the ASGI app."""
+    if isinstance(backend, RedisBackend):
+        from redis_client import create_async_client
+        return AsyncRedisBackend(create_async_client(), backend.ttl)
+    return AsyncBackend(backend)
@@ -0,0 +1,88 @@
+# benchmarks/bench_backends.py
+#
+# Micro-benchmarks of the common operations of every storage backend in
+# backends.py; tests/test_backends.py checks that they behave the same. The
+# redis backend uses the Redis configured by the usual REDIS_* environment
+# variables, or fakeredis with --fake-redis.
+#
+#   python benchmarks/bench_backends.py [--backends memory,file,redis] [--fake-redis] [--iterations 2000]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import backends
+from storage import build_responses
+
+PAYLOAD = '<div class="article">' + 'Reading text. ' * 1500 + '</div>'
+
+def entry(content):
+    return {'content': content, 'timestamp': time.time()}
+
+def save(backend, key, content):
+    backend.save(key, entry(content), build_responses(content))
+
+def measure(name, fn, iterations):
+    fn()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1e6
+    p99 = timings[int(len(timings) * 0.99)] * 1e6
+    print(f"  {name:<24} p50 {p50:9.1f} us   p99 {p99:9.1f} us")
+
+def benchmark(backend, iterations):
+    responses = build_responses(PAYLOAD)
+    backend.save('bench:payload', entry(PAYLOAD), responses)
+    for index in range(200):
+        save(backend, f'bench:many:{index}', '<p>small</p>')
+    measure('save', lambda: backend.save('bench:payload', entry(PAYLOAD), responses), iterations)
+    measure('get', lambda: backend.get(['bench:payload']), iterations)
+    measure('load', lambda: backend.load(['bench:payload']), iterations)
+    measure('version check', lambda: backend.load([], check=['bench:payload']), iterations)
+    measure('keys (200+)', lambda: list(backend.keys()), max(iterations // 20, 10))
+
+def make_backends(names, directory, fake_redis):
+    made = {}
+    for name in names:
+        if name == 'memory':
+            made[name] = backends.MemoryBackend()
+        elif name == 'file':
+            made[name] = backends.FileBackend(os.path.join(directory, 'bench.log'))
+        elif name == 'redis':
+            if fake_redis:
+                import fakeredis
+                client = fakeredis.FakeRedis(decode_responses=True)
+            else:
+                from redis_client import redis_client as client
+            made[name] = backends.RedisBackend(client)
+    return made
+
+def cleanup(backend):
+    if isinstance(backend, backends.RedisBackend):
+        keys = [key for key in backend.redis.scan_iter(match='*bench:*', count=1000)]
+        if keys:
+            backend.redis.delete(*keys)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the storage backends')
+    parser.add_argument('--backends', default='memory,file,redis')
+    parser.add_argument('--fake-redis', action='store_true', help='Use fakeredis instead of a Redis server.')
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    names = [name.strip() for name in args.backends.split(',') if name.strip()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, backend in make_backends(names, directory, args.fake_redis).items():
+            print(f"{name}:")
+            try:
+                benchmark(backend, args.iterations)
+            finally:
+                cleanup(backend)
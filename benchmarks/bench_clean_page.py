@@ -0,0 +1,72 @@
+# benchmarks/bench_clean_page.py
+#
+# Time scraper.clean_page against the previous double-parse cleaning code
+# (tests/legacy_cleaning.py) on saved pages, and check that both produce the
+# same output. Keys without a saved page use the load test's synthetic page.
+#
+#   python benchmarks/bench_clean_page.py --record   # save one page per html source
+#   python benchmarks/bench_clean_page.py [iterations]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import requests
+import scraper
+from load_test import UPSTREAM_PAGE
+from tests.legacy_cleaning import legacy_clean_page
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+def fixture_path(key):
+    return os.path.join(FIXTURES_DIR, f'{key}.html')
+
+def html_keys():
+    return [key for key, source in scraper.SOURCES.items() if source.parser == 'html']
+
+def record():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for key in html_keys():
+        url = scraper.SOURCES[key].url
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        with open(fixture_path(key), 'wb') as f:
+            f.write(response.content)
+        print(f"Saved {url} to {fixture_path(key)}")
+
+def measure(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return (time.perf_counter() - start) / iterations * 1000, result
+
+if __name__ == '__main__':
+    if '--record' in sys.argv:
+        record()
+        sys.exit(0)
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    parsers = ['html.parser']
+    try:
+        import lxml  # noqa: F401
+        parsers.append('lxml')
+    except ImportError:
+        pass
+
+    for key in html_keys():
+        if os.path.exists(fixture_path(key)):
+            with open(fixture_path(key), 'rb') as f:
+                html = f.read()
+        else:
+            print(f"{key:<28} no fixture, timing a synthetic page (run with --record)")
+            html = UPSTREAM_PAGE
+
+        legacy_ms, expected = measure(lambda: legacy_clean_page(key, html), iterations)
+        print(f"{key:<28} legacy       {legacy_ms:8.2f} ms")
+        for parser in parsers:
+            scraper.HTML_PARSER = parser
+            ms, result = measure(lambda: scraper.clean_page(key, html), iterations)
+            status = 'identical' if result == expected else 'DIFFERS'
+            print(f"{'':<28} {parser:<12} {ms:8.2f} ms  {legacy_ms / ms:4.1f}x  {status}")
@@ -0,0 +1,53 @@
+# benchmarks/bench_l1_cache.py
+#
+# Compare cache-hit latency of the old two-GET path (is_data_valid + load_data)
+# with storage.load_cached_entry. Runs against the store configured by
+# STORAGE_BACKEND and the usual REDIS_* environment variables.
+#
+#   python benchmarks/bench_l1_cache.py [iterations]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import storage
+from storage import store
+from backends import RedisBackend
+
+BENCH_KEY = 'bench:l1_cache'
+# Roughly the size of a scraped daily readings page
+PAYLOAD = '<div class="article">' + 'Reading text. ' * 1500 + '</div>'
+
+def two_get_path():
+    if storage.is_data_valid(store, BENCH_KEY, 12 * 60 * 60):
+        return storage.load_data(store, BENCH_KEY)
+
+def l1_path():
+    return storage.load_cached_entry(store, BENCH_KEY)[0]
+
+def measure(name, fn, iterations):
+    fn()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1e6
+    p99 = timings[int(len(timings) * 0.99)] * 1e6
+    print(f"{name:<28} p50 {p50:9.1f} us   p99 {p99:9.1f} us")
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    storage.save_data(store, BENCH_KEY, PAYLOAD)
+    try:
+        measure('is_data_valid + load_data', two_get_path, iterations)
+        storage.L1_CHECK_INTERVAL = 0
+        measure('L1 hit, version check', l1_path, iterations)
+        storage.L1_CHECK_INTERVAL = 60
+        measure('L1 hit, no store call', l1_path, iterations)
+    finally:
+        if isinstance(store, RedisBackend):
+            store.redis.delete(BENCH_KEY, f'version:{BENCH_KEY}', f'response:{BENCH_KEY}')
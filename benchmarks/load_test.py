@@ -0,0 +1,225 @@
+# benchmarks/load_test.py
+#
+# Load test comparing the sync Flask app (gunicorn, sync workers) with the
+# async ASGI app (hypercorn). Both run against an in-process fakeredis and a
+# local stand-in for the upstream sites, so only the serving model differs.
+#
+# Requests are made by a minimal keep-alive HTTP/1.1 client on raw asyncio
+# streams. A full client such as httpx costs several times the server's own
+# time per request, so on a small machine it measured itself rather than the
+# servers. The server CPU time per request is reported as well, read from
+# /proc where available, as it does not depend on the load generator.
+#
+# Needs fakeredis, gunicorn and hypercorn:
+#
+#   python benchmarks/load_test.py [--workers 2] [--concurrency 200] [--requests 2000] [--upstream-delay 0.5]
+#
+# Scenarios:
+#   cache-hit      GET /api/v1/content/daily_readings, served from the cache
+#   slow-upstream  GET /api/v1/content/mass_reading_details/<date> for recent dates
+#                  that are not archived yet, so every request waits on upstream
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+API_KEY = 'load-test'
+
+UPSTREAM_PAGE = b"""<html><body><div class="article softd_single"><h1 class="title">Reading</h1>
+<p>""" + b'Reading text. ' * 500 + b"""</p></div>
+<table><tr><th>First reading</th><th align="right">Isaiah 55:10-11</th></tr>
+<tr><th>Gospel</th><th align="right">Matthew 6:7-15</th></tr></table></body></html>"""
+
+def start_upstream(delay):
+    """Serve UPSTREAM_PAGE for every path after waiting delay seconds."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(UPSTREAM_PAGE)))
+            self.end_headers()
+            self.wfile.write(UPSTREAM_PAGE)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+def _prepare_worker():
+    """Point a server worker at fakeredis and the stand-in upstream."""
+    import fakeredis
+
+    fake_server = fakeredis.FakeServer()
+    import redis_client as module
+    module.redis_client = fakeredis.FakeRedis(server=fake_server, decode_responses=True)
+    module.create_async_client = lambda: fakeredis.FakeAsyncRedis(server=fake_server, decode_responses=True)
+
+    import scraper
+    from sources import SOURCES
+    upstream = os.environ['LOAD_TEST_UPSTREAM']
+    for key, source in SOURCES.items():
+        dated_url = f'{upstream}/{key}/{{date:%Y-%m-%d}}' if source.dated_url else None
+        SOURCES[key] = source._replace(url=f'{upstream}/{key}', dated_url=dated_url)
+
+    import storage
+    storage.save_data(storage.store, 'daily_readings', scraper.clean_page('daily_readings', UPSTREAM_PAGE))
+
+# Gunicorn and hypercorn call these factories in each worker
+
+def create_sync_app():
+    _prepare_worker()
+    import app
+    return app.app
+
+def create_async_app():
+    _prepare_worker()
+    import asgi_app
+    return asgi_app.app
+
+def start_server(kind, port, workers, upstream, archive_dir):
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([REPO_DIR, BENCH_DIR]),
+        API_KEYS=API_KEY,
+        LOAD_TEST_UPSTREAM=upstream,
+        ARCHIVE_PATH=os.path.join(archive_dir, f'{kind}.sqlite3'),
+        # Rate limiting stays on, with limits the load test cannot reach
+        ROUTE_LIMIT=str(10 ** 9),
+        DEFAULT_LIMIT=str(10 ** 9),
+    )
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    if kind == 'sync':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+                   '--timeout', '120', 'load_test:create_sync_app()']
+    else:
+        command = [sys.executable, '-m', 'hypercorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+                   'load_test:create_async_app()']
+    return subprocess.Popen(command, cwd=BENCH_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def get(port, path, connection=None):
+    """GET path from the server on port, over connection if it is still open.
+
+    Returns (status, connection): the connection to reuse for the next
+    request, or None if the server closed it.
+    """
+    if connection is None:
+        connection = await asyncio.open_connection('127.0.0.1', port)
+    reader, writer = connection
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept-Encoding: gzip\r\n\r\n'.encode('ascii'))
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    headers = dict(line.lower().split(': ', 1) for line in head[1:] if ': ' in line)
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    if headers.get('connection') == 'close':
+        writer.close()
+        connection = None
+    return int(head[0].split(' ')[1]), connection
+
+async def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, connection = await get(port, '/metrics')
+            if connection:
+                connection[1].close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+async def run_scenario(port, paths, concurrency):
+    """Request every path with at most concurrency requests in flight; return (latencies, errors, seconds)."""
+    queue = list(reversed(paths))
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        connection = None
+        while queue:
+            path = queue.pop()
+            start = time.perf_counter()
+            try:
+                status, connection = await get(port, path, connection)
+                if status != 200:
+                    errors += 1
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                connection = None
+            latencies.append(time.perf_counter() - start)
+        if connection:
+            connection[1].close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return sorted(latencies), errors, time.perf_counter() - start
+
+def cpu_seconds(pid):
+    """Return the CPU time used by process pid and its children (the server's workers), or None without /proc."""
+    total = 0.0
+    try:
+        children = open(f'/proc/{pid}/task/{pid}/children').read().split()
+        for process in [pid] + [int(child) for child in children]:
+            stat = open(f'/proc/{process}/stat').read().rsplit(')', 1)[1].split()
+            total += (int(stat[11]) + int(stat[12])) / os.sysconf('SC_CLK_TCK')
+    except OSError:
+        return None
+    return total
+
+def scenario_paths(name, count):
+    if name == 'cache-hit':
+        return [f'/api/v1/content/daily_readings?api_key={API_KEY}'] * count
+    # A different, not yet archived date for every request, going back from
+    # yesterday so they stay within the days the app fills in (each server
+    # has its own archive)
+    yesterday = date.today() - timedelta(days=1)
+    return [f'/api/v1/content/mass_reading_details/{(yesterday - timedelta(days=i)).isoformat()}?api_key={API_KEY}'
+            for i in range(count)]
+
+async def main(args):
+    upstream = start_upstream(args.upstream_delay)
+    with tempfile.TemporaryDirectory() as archive_dir:
+        for index, kind in enumerate(('sync', 'async')):
+            port = args.port + index
+            server = start_server(kind, port, args.workers, upstream, archive_dir)
+            try:
+                await wait_ready(port)
+                # Warm up the workers and their caches
+                await run_scenario(port, scenario_paths('cache-hit', args.concurrency * 2), args.concurrency)
+                for name, count in (('cache-hit', args.requests), ('slow-upstream', args.requests // 10)):
+                    paths = scenario_paths(name, count)
+                    cpu_before = cpu_seconds(server.pid)
+                    latencies, errors, seconds = await run_scenario(port, paths, args.concurrency)
+                    cpu_after = cpu_seconds(server.pid)
+                    p50 = latencies[len(latencies) // 2] * 1000
+                    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+                    cpu = f"{(cpu_after - cpu_before) / count * 1000:6.2f} ms" if cpu_before is not None else '     n/a'
+                    print(f"{kind:<6} {name:<14} {count / seconds:9.1f} req/s   p50 {p50:8.1f} ms   "
+                          f"p99 {p99:8.1f} ms   server cpu/req {cpu}   errors {errors}")
+            finally:
+                server.terminate()
+                server.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the sync and async apps under load')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--upstream-delay', type=float, default=0.5)
+    parser.add_argument('--port', type=int, default=5100)
+    asyncio.run(main(parser.parse_args()))
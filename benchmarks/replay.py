@@ -0,0 +1,368 @@
+# benchmarks/replay.py
+#
+# Offline replay benchmark for the whole request path of app.py: Flask's
+# test client, quota checks, storage, scraping and cleaning. Upstream pages
+# are served from recorded fixtures by a local HTTP server, and storage is
+# the in-process memory backend (or fakeredis with --fake-redis), so runs
+# need no network and are repeatable.
+#
+#   python benchmarks/replay.py --record                 # save the current page of every source
+#   python benchmarks/replay.py [--requests 500] [--fake-redis] [--json results.json]
+#   python benchmarks/replay.py --update-thresholds      # accept this machine's results as the new limits
+#
+# Scenarios:
+#   cache-hit   GET /api/v1/content/<key> for every key in turn, served from the cache
+#   cache-miss  the same with the store emptied before each request, so every request scrapes
+#   stampede    --stampede-clients concurrent requests for one key on an empty store;
+#               the lease should let a single request reach upstream per round
+#   batch       GET /api/v1/content?keys=<every key>, served from the cache
+#
+# Each scenario reports p50/p99 latency, throughput, peak traced memory
+# (measured in a second pass under tracemalloc) and upstream fetches per
+# operation. The run exits with status 1 if any result is worse than the
+# limits in replay_thresholds.json, or if any request fails. Sources without
+# a recorded fixture are served a synthetic page. The limits hold for the
+# default options on the machine that wrote them; after recording fixtures
+# or moving to another machine, rerun with --update-thresholds.
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import contextlib
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from load_test import UPSTREAM_PAGE
+
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+THRESHOLDS_PATH = os.path.join(BENCH_DIR, 'replay_thresholds.json')
+API_KEY = 'replay'
+HEADERS = {'X-API-Key': API_KEY}
+
+# Headroom given to this machine's results by --update-thresholds
+LATENCY_HEADROOM = 2.0
+# Sub-millisecond latencies are noisy, so limits are at least this far above the result
+LATENCY_SLACK_MS = 2.0
+THROUGHPUT_HEADROOM = 0.5
+MEMORY_HEADROOM = 1.5
+
+def fixture_path(key):
+    return os.path.join(FIXTURES_DIR, f'{key}.html')
+
+def record():
+    import requests
+    from sources import SOURCES
+
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for key, source in SOURCES.items():
+        response = requests.get(source.url, timeout=10)
+        response.raise_for_status()
+        with open(fixture_path(key), 'wb') as f:
+            f.write(response.content)
+        print(f"Saved {source.url} to {fixture_path(key)}")
+
+def load_fixtures(keys):
+    """Return {key: page bytes}, using the synthetic load test page for keys without a fixture."""
+    pages = {}
+    for key in keys:
+        if os.path.exists(fixture_path(key)):
+            with open(fixture_path(key), 'rb') as f:
+                pages[key] = f.read()
+        else:
+            print(f"{key}: no fixture, serving a synthetic page (run with --record)")
+            pages[key] = UPSTREAM_PAGE
+    return pages
+
+class Upstream:
+    """Local stand-in for the upstream sites, serving /<key> from fixtures and counting requests.
+
+    Pages carry an ETag and conditional requests get a 304, as from the real sites.
+    """
+
+    def __init__(self, pages, delay):
+        self.requests = 0
+        lock = threading.Lock()
+        upstream = self
+        etags = {key: '"' + hashlib.sha1(page).hexdigest() + '"' for key, page in pages.items()}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out together, without Nagle/delayed ACK stalls
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with lock:
+                    upstream.requests += 1
+                time.sleep(delay)
+                key = self.path.strip('/').split('/')[0]
+                if key not in pages:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.headers.get('If-None-Match') == etags[key]:
+                    self.send_response(304)
+                    self.send_header('ETag', etags[key])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etags[key])
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(pages[key])))
+                self.end_headers()
+                self.wfile.write(pages[key])
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def load_app(upstream_url, fake_redis, archive_dir):
+    """Import app.py against the chosen store, with every source pointed at the local upstream."""
+    os.environ.update(
+        API_KEYS=API_KEY,
+        ARCHIVE_PATH=os.path.join(archive_dir, 'replay.sqlite3'),
+        STORAGE_BACKEND='redis' if fake_redis else 'memory',
+        # Rate limiting stays on, with limits the replay cannot reach
+        ROUTE_LIMIT=str(10 ** 9),
+        DEFAULT_LIMIT=str(10 ** 9),
+    )
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    if fake_redis:
+        import fakeredis
+        import redis_client
+        redis_client.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+    from sources import SOURCES
+    for key, source in SOURCES.items():
+        dated_url = f'{upstream_url}/{key}/{{date:%Y-%m-%d}}' if source.dated_url else None
+        SOURCES[key] = source._replace(url=f'{upstream_url}/{key}', dated_url=dated_url)
+
+    import app
+    return app
+
+class Replay:
+    """The app under test and the ways the scenarios drive it."""
+
+    def __init__(self, app_module, upstream):
+        self.app_module = app_module
+        self.upstream = upstream
+        self.client = app_module.app.test_client()
+        self.keys = list(app_module.ALL_KEYS)
+        self.errors = 0
+        self._errors_lock = threading.Lock()
+        self.mark()
+
+    def mark(self):
+        """Start measuring here: scenarios call this after any warm-up that should not count."""
+        self.started = time.perf_counter()
+        self.fetches_at_start = self.upstream.requests
+
+    def get(self, path, client=None):
+        """GET path and return its latency in seconds, counting anything but a 200 as an error."""
+        start = time.perf_counter()
+        response = (client or self.client).get(path, headers=HEADERS)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            with self._errors_lock:
+                self.errors += 1
+        return elapsed
+
+    def reset_store(self):
+        """Forget every saved entry, in the store and in this process's cache."""
+        import storage
+        from backends import MemoryBackend, RedisBackend
+
+        with storage._l1_lock:
+            storage._l1_cache.clear()
+        store = self.app_module.store
+        if isinstance(store, RedisBackend):
+            store.redis.flushall()
+        else:
+            self.app_module.store = MemoryBackend(store.ttl)
+
+    def warm(self):
+        for key in self.keys:
+            self.get(f'/api/v1/content/{key}')
+
+def run_cache_hit(replay, args):
+    replay.warm()
+    replay.mark()
+    latencies = [replay.get(f'/api/v1/content/{replay.keys[i % len(replay.keys)]}') for i in range(args.requests)]
+    return latencies, len(latencies)
+
+def run_cache_miss(replay, args):
+    latencies = []
+    for i in range(max(args.requests // 10, len(replay.keys))):
+        replay.reset_store()
+        latencies.append(replay.get(f'/api/v1/content/{replay.keys[i % len(replay.keys)]}'))
+    return latencies, len(latencies)
+
+def run_stampede(replay, args):
+    latencies = []
+    lock = threading.Lock()
+    for round_index in range(args.stampede_rounds):
+        replay.reset_store()
+        key = replay.keys[round_index % len(replay.keys)]
+        barrier = threading.Barrier(args.stampede_clients)
+
+        def client():
+            test_client = replay.app_module.app.test_client()
+            barrier.wait()
+            elapsed = replay.get(f'/api/v1/content/{key}', test_client)
+            with lock:
+                latencies.append(elapsed)
+
+        threads = [threading.Thread(target=client) for _ in range(args.stampede_clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return latencies, args.stampede_rounds
+
+def run_batch(replay, args):
+    replay.warm()
+    replay.mark()
+    path = f"/api/v1/content?keys={','.join(replay.keys)}"
+    latencies = [replay.get(path) for _ in range(max(args.requests // len(replay.keys), 1))]
+    return latencies, len(latencies)
+
+SCENARIOS = {
+    'cache-hit': run_cache_hit,
+    'cache-miss': run_cache_miss,
+    'stampede': run_stampede,
+    'batch': run_batch,
+}
+
+def percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+def run_scenario(replay, name, args):
+    """Run a scenario once for timings and once under tracemalloc for its peak memory."""
+    replay.reset_store()
+    replay.errors = 0
+    replay.mark()
+    latencies, operations = SCENARIOS[name](replay, args)
+    seconds = time.perf_counter() - replay.started
+    fetches = replay.upstream.requests - replay.fetches_at_start
+
+    replay.reset_store()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    SCENARIOS[name](replay, args)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput': len(latencies) / seconds,
+        'peak_mib': peak / (1024 * 1024),
+        # Upstream fetches per request, or per round for the stampede; the
+        # second (memory) pass is not counted
+        'upstream_per_op': fetches / operations,
+        'errors': replay.errors,
+    }
+
+def check(results, thresholds):
+    """Return a message for every result outside its limit."""
+    failures = []
+    for name, result in results.items():
+        if result['errors']:
+            failures.append(f"{name}: {result['errors']} requests failed")
+        limits = thresholds.get(name, {})
+        for field in ('p50_ms', 'p99_ms', 'peak_mib', 'upstream_per_op'):
+            if field in limits and result[field] > limits[field]:
+                failures.append(f"{name}: {field} {result[field]:.2f} is over the limit of {limits[field]:.2f}")
+        if 'throughput' in limits and result['throughput'] < limits['throughput']:
+            failures.append(f"{name}: throughput {result['throughput']:.1f} req/s is under the limit of {limits['throughput']:.1f}")
+    return failures
+
+def thresholds_from(results):
+    """Turn this run's results into limits with some headroom, for --update-thresholds."""
+    return {
+        name: {
+            'p50_ms': round(max(result['p50_ms'] * LATENCY_HEADROOM, result['p50_ms'] + LATENCY_SLACK_MS), 2),
+            'p99_ms': round(max(result['p99_ms'] * LATENCY_HEADROOM, result['p99_ms'] + LATENCY_SLACK_MS), 2),
+            'throughput': round(result['throughput'] * THROUGHPUT_HEADROOM, 1),
+            'peak_mib': round(max(result['peak_mib'], 1) * MEMORY_HEADROOM, 2),
+            # Fetch counts do not depend on the machine, so they get no headroom
+            'upstream_per_op': round(result['upstream_per_op'], 2),
+        }
+        for name, result in results.items()
+    }
+
+def main(args):
+    from sources import ALL_KEYS
+
+    upstream = Upstream(load_fixtures(ALL_KEYS), args.upstream_delay)
+    try:
+        with tempfile.TemporaryDirectory() as archive_dir:
+            replay = Replay(load_app(upstream.url, args.fake_redis, archive_dir), upstream)
+            names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+            results = {}
+            print(f"{'scenario':<12} {'requests':>8} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'peak MiB':>9} {'upstream/op':>12}")
+            for name in names:
+                # The app logs every scrape; keep the table readable unless asked
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                    result = results[name] = run_scenario(replay, name, args)
+                print(f"{name:<12} {result['requests']:>8} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                      f"{result['throughput']:>9.1f} {result['peak_mib']:>9.2f} {result['upstream_per_op']:>12.2f}")
+    finally:
+        upstream.close()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_thresholds:
+        with open(args.thresholds, 'w') as f:
+            json.dump(thresholds_from(results), f, indent=4)
+            f.write('\n')
+        print(f"Wrote {args.thresholds}")
+        return 0
+
+    with open(args.thresholds) as f:
+        failures = check(results, json.load(f))
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded traffic against app.py and check for regressions')
+    parser.add_argument('--record', action='store_true', help='Save the current upstream page of every source as a fixture and exit.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='Requests in the cache-hit scenario; the others scale from it.')
+    parser.add_argument('--stampede-clients', type=int, default=50)
+    parser.add_argument('--stampede-rounds', type=int, default=5)
+    parser.add_argument('--upstream-delay', type=float, default=0.05, help='Seconds the local upstream waits before answering.')
+    parser.add_argument('--fake-redis', action='store_true', help='Use fakeredis instead of the in-process memory backend.')
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH)
+    parser.add_argument('--update-thresholds', action='store_true', help="Write this run's results, with headroom, as the thresholds.")
+    parser.add_argument('--json', help='Also write the results to this file.')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's output while the scenarios run.")
+    args = parser.parse_args()
+
+    if args.record:
+        record()
+        sys.exit(0)
+    sys.exit(main(args))
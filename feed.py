@@ -0,0 +1,111 @@
+# feed.py
+#
+# Push notifications of content changes for the ASGI app. One background
+# task per process follows the store's saves (Redis pub/sub, or polling for
+# the memory and file backends) and keeps the current version of every key.
+# A key's version is the ETag of its content, the one the content endpoints
+# send: saving the same content again (a background refresh, or upstream
+# answering 304) does not change it, so clients are only told about real
+# changes and can revalidate with If-None-Match.
+# Subscribers wait on a shared asyncio.Event that is set on every change,
+# so thousands of idle SSE or long-poll clients cost a coroutine each
+# rather than a thread or a Redis connection.
+
+import json
+import asyncio
+import hashlib
+from redis_client import UNAVAILABLE_ERRORS, RETRY_INTERVAL, mark_unavailable
+
+# Seconds between keep-alive comments on an idle event stream
+HEARTBEAT_INTERVAL = 15
+# Default and longest wait of a long-poll request, in seconds; kept under
+# the 60 second idle timeout of common proxies
+LONG_POLL_TIMEOUT = 30
+MAX_LONG_POLL_TIMEOUT = 55
+
+class UpdateFeed:
+    """The current version of each key, and a way to wait until one changes."""
+
+    def __init__(self, store, keys):
+        self.store = store
+        self.keys = list(keys)
+        self.versions = {}
+        self._task = None
+        self._ready = None
+        self._changed = None
+
+    async def start(self):
+        """Start following the store, if this process has not yet, and wait for the first versions."""
+        if self._task is None:
+            self._ready = asyncio.Event()
+            self._changed = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._follow())
+        await self._ready.wait()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _follow(self):
+        while True:
+            try:
+                # Catch up on anything saved while nobody was listening
+                await self._check(self.keys)
+                self._ready.set()
+                async for key in self.store.updates():
+                    if key in self.versions:
+                        await self._check([key])
+            except UNAVAILABLE_ERRORS as e:
+                mark_unavailable(e)
+            except Exception as e:
+                print(f"Error following content updates: {e}")
+            # Subscribers keep waiting on the last known versions meanwhile
+            self._ready.set()
+            await asyncio.sleep(RETRY_INTERVAL)
+
+    async def _check(self, keys):
+        """Load the versions of keys and wake the subscribers if any changed."""
+        # Only the ETags are read, not the entries and response bodies
+        versions = dict(zip(keys, await self.store.etags(keys)))
+        changed = {key: version for key, version in versions.items() if self.versions.get(key, ...) != version}
+        if changed:
+            self.versions.update(changed)
+            event, self._changed = self._changed, asyncio.Event()
+            event.set()
+
+    def current(self, keys):
+        """Return {key: version} for keys; the version is None for keys with no content yet."""
+        return {key: self.versions.get(key) for key in keys}
+
+    async def wait_for_change(self, known, timeout):
+        """Wait until the version of a key in known ({key: version}) differs from it.
+
+        Returns the current versions of the keys in known, or None if
+        nothing changed within timeout seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            current = self.current(known)
+            if current != known:
+                return current
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+def versions_cursor(versions):
+    """Return an opaque cursor for a set of versions, for long-poll clients to send back."""
+    return hashlib.sha256(json.dumps(versions, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,66 @@
+# fetcher.py
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from redis_client import redis_available
+
+# Timeouts for upstream requests in seconds: (connect, read)
+TIMEOUT = (5, 15)
+
+# Retry connection errors and transient upstream failures with exponential backoff
+RETRIES = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=('GET',),
+    raise_on_status=False,
+)
+
+# One pooled session per process, so connections to upstream are kept alive and reused
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=RETRIES)
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+def conditional_headers(validators):
+    """Build If-None-Match/If-Modified-Since headers from stored validators."""
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def response_validators(headers):
+    """Pick the ETag and Last-Modified validators out of response headers."""
+    validators = {}
+    if headers.get('ETag'):
+        validators['etag'] = headers['ETag']
+    if headers.get('Last-Modified'):
+        validators['last_modified'] = headers['Last-Modified']
+    return validators
+
+def fetch(url, store=None):
+    """Fetch url with the shared session.
+
+    If store is given, the request is made conditional on the ETag and
+    Last-Modified validators stored from the previous fetch, and the new
+    validators are stored in it. Returns the response, or None if upstream
+    replied 304 Not Modified. Raises requests.RequestException on failure.
+    """
+    if store is not None and not redis_available():
+        # Fetch unconditionally rather than wait on an unreachable Redis
+        store = None
+    headers = {}
+    if store is not None:
+        headers = conditional_headers(store.load_validators(url))
+
+    response = session.get(url, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+
+    if store is not None:
+        store.save_validators(url, response_validators(response.headers))
+    return response
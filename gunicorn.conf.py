@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+
+import os
+import shutil
+
+def on_starting(server):
+    """Clear metrics left over from a previous run."""
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+def child_exit(server, worker):
+    """Stop reporting a worker's live gauges once it exits."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
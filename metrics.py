@@ -0,0 +1,102 @@
+# metrics.py
+
+import os
+import time
+import inspect
+from functools import wraps
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+# Under gunicorn each worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+# and /metrics aggregates them, so every scrape sees all workers
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds', 'Time spent handling API requests.',
+    ['endpoint', 'method', 'status'],
+)
+STORAGE_LATENCY = Histogram(
+    'storage_operation_duration_seconds', 'Time spent in storage operations, mostly Redis round trips.',
+    ['operation'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups_total', 'Content lookups by key and result (hit, stale or miss).',
+    ['key', 'result'],
+)
+SCRAPE_LATENCY = Histogram(
+    'scrape_duration_seconds', 'Time spent fetching and parsing upstream pages.',
+    ['key'],
+    buckets=(.1, .25, .5, 1, 2.5, 5, 10, 20, 40),
+)
+SCRAPE_FAILURES = Counter(
+    'scrape_failures_total', 'Scrapes that returned no content.',
+    ['key'],
+)
+PAYLOAD_SIZE = Histogram(
+    'payload_size_bytes', 'Size of saved response bodies by key and encoding.',
+    ['key', 'encoding'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+
+def track_storage(operation):
+    """Decorator recording the duration of a storage operation. Works on sync and async functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with STORAGE_LATENCY.labels(operation=operation).time():
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STORAGE_LATENCY.labels(operation=operation).time():
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def track_scrape(key=None):
+    """Decorator recording the duration and failures of a scrape.
+
+    The key label is the given key, or else the scrape function's first argument.
+    Works on sync and async functions.
+    """
+    def record(label, start, result):
+        SCRAPE_LATENCY.labels(key=label).observe(time.perf_counter() - start)
+        if not result:
+            SCRAPE_FAILURES.labels(key=label).inc()
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                result = await fn(*args, **kwargs)
+                record(key or args[0], start, result)
+                return result
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            record(key or args[0], start, result)
+            return result
+        return wrapper
+    return decorator
+
+def observe_payload(key, responses):
+    """Record the sizes of a key's precomputed response bodies."""
+    for encoding in ('identity', 'gzip', 'br'):
+        if encoding in responses:
+            PAYLOAD_SIZE.labels(key=key, encoding=encoding).observe(len(responses[encoding]))
+
+def render_metrics():
+    """Return the metrics exposition body and its content type."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,134 @@
+# quota.py
+#
+# Request quotas as token buckets. Each process keeps a local bucket per
+# client and admits requests from it without touching the store. Every
+# SYNC_BATCH requests, or SYNC_INTERVAL seconds, the tokens it used are
+# taken from a shared bucket in the store and the local bucket is reset to
+# what is left there. All workers therefore drain one budget per client,
+# and a worker can overshoot it by at most one batch.
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from redis.exceptions import RedisError
+from redis_client import redis_available, mark_unavailable, UNAVAILABLE_ERRORS
+
+# Requests admitted locally before they are reported to the store
+SYNC_BATCH = 10
+# Longest time a bucket goes without being synced while in use (seconds)
+SYNC_INTERVAL = 5.0
+# Local buckets kept per quota. Clients can be as many as remote addresses,
+# so the least recently used buckets are dropped beyond this; a dropped
+# client starts again from the shared bucket on its next request.
+MAX_BUCKETS = 10000
+
+class TokenBucket:
+    """A process-local view of one client's shared bucket."""
+    __slots__ = ('tokens', 'updated', 'used', 'synced')
+
+    def __init__(self, capacity):
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        # Tokens taken locally and not yet reported to the store
+        self.used = 0
+        # Never synced, so the first request syncs straight away
+        self.synced = float('-inf')
+
+class Quota:
+    """A limit of `limit` requests per `window` seconds for each client, shared through the store."""
+
+    def __init__(self, name, limit, window):
+        self.name = name
+        self.capacity = limit
+        self.rate = limit / window
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bucket_name(self, client):
+        # Clients are API keys, which should not show up in stored key names
+        return f"{self.name}:{hashlib.sha256(client.encode('utf-8')).hexdigest()[:16]}"
+
+    def take(self, client):
+        """Take a token for client from the local bucket.
+
+        Returns (allowed, used): used is the number of tokens to report to
+        the store now, or 0 if the bucket is not due a sync.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.capacity)
+                if len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            allowed = bucket.tokens >= 1
+            if allowed:
+                bucket.tokens -= 1
+                bucket.used += 1
+            if bucket.used and (bucket.used >= SYNC_BATCH or now - bucket.synced >= SYNC_INTERVAL):
+                used, bucket.used, bucket.synced = bucket.used, 0, now
+                return allowed, used
+            return allowed, 0
+
+    def synced(self, client, tokens):
+        """Reset client's local bucket to the tokens left in the store, less any taken during the sync."""
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is not None:
+                bucket.tokens = min(self.capacity, tokens) - bucket.used
+                bucket.updated = time.monotonic()
+
+    def sync_failed(self, client, used):
+        """Keep tokens that could not be reported, to report them with the next batch."""
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is not None:
+                bucket.used += used
+
+def check_quota(store, quota, client):
+    """Take one request from client's quota. Returns False if the client is over it.
+
+    If the store is unavailable, requests are still limited by the local bucket.
+    """
+    allowed, used = quota.take(client)
+    if used and not redis_available():
+        quota.sync_failed(client, used)
+    elif used:
+        try:
+            tokens = store.take_tokens(quota.bucket_name(client), quota.capacity, quota.rate, used)
+        except RedisError as e:
+            if isinstance(e, UNAVAILABLE_ERRORS):
+                mark_unavailable(e)
+            else:
+                print(f"Error syncing quota {quota.bucket_name(client)}: {e}")
+            quota.sync_failed(client, used)
+        else:
+            quota.synced(client, tokens)
+            # The shared bucket has the last word, e.g. for a client whose local bucket was dropped
+            allowed = allowed and tokens >= 0
+    return allowed
+
+async def check_quota_async(store, quota, client):
+    """check_quota for an async store."""
+    allowed, used = quota.take(client)
+    if used and not redis_available():
+        quota.sync_failed(client, used)
+    elif used:
+        try:
+            tokens = await store.take_tokens(quota.bucket_name(client), quota.capacity, quota.rate, used)
+        except RedisError as e:
+            if isinstance(e, UNAVAILABLE_ERRORS):
+                mark_unavailable(e)
+            else:
+                print(f"Error syncing quota {quota.bucket_name(client)}: {e}")
+            quota.sync_failed(client, used)
+        else:
+            quota.synced(client, tokens)
+            # The shared bucket has the last word, e.g. for a client whose local bucket was dropped
+            allowed = allowed and tokens >= 0
+    return allowed
@@ -1,25 +1,75 @@
 # redis_client.py
+#
+# One shared Redis connection pool per process. Nothing connects at import
+# time: connections are opened on first use, so workers boot, and the docs
+# page renders, while Redis is down. Callers that can do without Redis
+# catch UNAVAILABLE_ERRORS, call mark_unavailable and check redis_available
+# before trying again, so an outage costs one timeout every RETRY_INTERVAL
+# rather than one per request.
 
 import os
-from redis import Redis
+import time
+from redis import BlockingConnectionPool, Redis
+from redis.backoff import NoBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
 
 # Load Redis configuration from environment variables
 REDIS_HOST = os.getenv('REDIS_HOST', 'srv-captain--redis-rate-limiter')
 REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', '')
 
-# Initialize Redis client
-redis_client = Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    password=REDIS_PASSWORD,
-    decode_responses=True
+# Timeouts in seconds, so requests fail over quickly when Redis hangs
+SOCKET_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', '1'))
+SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '2'))
+# Pooled connections idle for longer than this are pinged before reuse (seconds)
+HEALTH_CHECK_INTERVAL = 30
+# Connections per process; request threads wait up to SOCKET_TIMEOUT for a free one
+MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '32'))
+# Failed commands are retried once straight away, in case a pooled connection went stale
+RETRIES = 1
+# How long Redis is skipped after it could not be reached (seconds)
+RETRY_INTERVAL = 5.0
+
+# Errors meaning Redis could not be reached, as opposed to a failed command
+UNAVAILABLE_ERRORS = (ConnectionError, TimeoutError)
+
+CONNECTION_OPTIONS = {
+    'host': REDIS_HOST,
+    'port': REDIS_PORT,
+    'password': REDIS_PASSWORD or None,
+    'decode_responses': True,
+    'socket_connect_timeout': SOCKET_CONNECT_TIMEOUT,
+    'socket_timeout': SOCKET_TIMEOUT,
+    'health_check_interval': HEALTH_CHECK_INTERVAL,
+}
+
+pool = BlockingConnectionPool(
+    max_connections=MAX_CONNECTIONS, timeout=SOCKET_TIMEOUT, retry=Retry(NoBackoff(), RETRIES), **CONNECTION_OPTIONS,
 )
+redis_client = Redis(connection_pool=pool)
+
+_unavailable_until = 0.0
+
+def redis_available():
+    """Return False while Redis is being skipped after a connection failure."""
+    return time.monotonic() >= _unavailable_until
+
+def mark_unavailable(error):
+    """Skip Redis for RETRY_INTERVAL seconds after it could not be reached."""
+    global _unavailable_until
+    if redis_available():
+        print(f"Redis unavailable, retrying in {RETRY_INTERVAL:g}s: {error}")
+    _unavailable_until = time.monotonic() + RETRY_INTERVAL
+
+def create_async_client():
+    """Create a redis.asyncio client with the same configuration, for the ASGI app.
 
-# Test Redis connection
-try:
-    redis_client.ping()
-    print("Connected to Redis successfully!")
-except Exception as e:
-    print(f"Error connecting to Redis: {e}")
-    raise
\ No newline at end of file
+    Its pool belongs to the event loop that first uses it, so it is created per process.
+    """
+    from redis.asyncio import BlockingConnectionPool as AsyncBlockingConnectionPool, Redis as AsyncRedis
+    from redis.asyncio.retry import Retry as AsyncRetry
+    return AsyncRedis(connection_pool=AsyncBlockingConnectionPool(
+        max_connections=MAX_CONNECTIONS, timeout=SOCKET_TIMEOUT, retry=AsyncRetry(NoBackoff(), RETRIES),
+        **CONNECTION_OPTIONS,
+    ))
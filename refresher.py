@@ -0,0 +1,65 @@
+# refresher.py
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from scraper import ALL_KEYS, scrape_all
+from sources import SOURCES
+
+# Upstream sites publish the new day's content at local midnight, in each
+# source's timezone and on its publish_days. Every source is also refreshed
+# every refresh_interval, well inside its ttl, so requests are served from
+# the cache and never have to scrape.
+
+# How long after local midnight to wait before fetching the new day's content
+PUBLISH_DELAY = timedelta(minutes=int(os.getenv('REFRESH_PUBLISH_DELAY_MINUTES', '10')))
+# How soon to retry keys whose last scrape failed
+RETRY_INTERVAL = timedelta(minutes=5)
+
+def next_publish_time(now, publish_days=range(7)):
+    """Return the first publish time (local midnight plus PUBLISH_DELAY) after now on one of publish_days."""
+    publish = now.replace(hour=0, minute=0, second=0, microsecond=0) + PUBLISH_DELAY
+    while publish <= now or publish.weekday() not in publish_days:
+        publish += timedelta(days=1)
+    return publish
+
+def next_refresh_time(source, now):
+    """Return when a source is next due: its next publish time or one refresh_interval from now, whichever is sooner."""
+    local_now = now.astimezone(source.timezone)
+    return min(
+        next_publish_time(local_now, source.publish_days),
+        local_now + timedelta(seconds=source.refresh_interval),
+    )
+
+def run(store):
+    """Keep every key fresh in the store, scraping each shortly after its upstream publishes."""
+    # Warm every key on startup
+    now = datetime.now(timezone.utc)
+    due = {key: now for key in ALL_KEYS}
+
+    while True:
+        pending = sorted(key for key, due_time in due.items() if due_time <= now)
+        if pending:
+            print(f"Refreshing {', '.join(pending)}...")
+            saved = set(scrape_all(store, pending))
+            now = datetime.now(timezone.utc)
+            for key in pending:
+                due[key] = next_refresh_time(SOURCES[key], now)
+                if key not in saved:
+                    due[key] = min(due[key], now + RETRY_INTERVAL)
+
+        time.sleep(max((min(due.values()) - now).total_seconds(), 0))
+        now = datetime.now(timezone.utc)
+
+if __name__ == '__main__':
+    import argparse
+    from storage import store
+
+    parser = argparse.ArgumentParser(description='Keep the API cache warm by refreshing content on the upstream publish schedule')
+    parser.add_argument('--once', action='store_true', help='Refresh every key once and exit.')
+    args = parser.parse_args()
+
+    if args.once:
+        scrape_all(store)
+    else:
+        run(store)
@@ -1,42 +1,51 @@
+import os
 import requests
 from bs4 import BeautifulSoup, Comment
+from bs4.builder import builder_registry
 import re
+from typing import Dict, NamedTuple, Optional
+from fetcher import fetch
+from sources import SOURCES, ALL_KEYS, source_url
+from metrics import track_scrape
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-URLS = {
-    'daily_readings': {
-        'url': 'https://www.catholicireland.net/readings/',
-        'css_selector': 'div.article.softd_single',
-    },
-    'sunday_homily': {
-        'url': 'https://www.catholicireland.net/sunday-homily/',
-        'css_selector': 'div.article',
-    },
-    'saint_of_the_day': {
-        'url': 'https://www.catholicireland.net/saint-day/',
-        'css_selector': 'div.article.softd_single',
-    },
-    'next_sunday_reading': {
-        'url': 'https://www.catholicireland.net/readings/?feature=sunday',
-        'css_selector': 'div.article.softd_single',
-    },
-    'next_sunday_reading_irish': {
-        'url': 'https://www.catholicireland.net/readings/?feature=sunday&lang=irish',
-        'css_selector': 'div.article.softd_single',
-    },
-    'daily_readings_irish': {
-        'url': 'https://www.catholicireland.net/readings/?feature=today&lang=irish',
-        'css_selector': 'div.article.softd_single',
-    },
-}
+def resolve_parser(name):
+    """Return name if BeautifulSoup has a tree builder for it, else 'html.parser', which is always available."""
+    if builder_registry.lookup(name) is None:
+        print(f"HTML parser '{name}' is not available (is lxml installed?); using html.parser")
+        return 'html.parser'
+    return name
+
+# BeautifulSoup tree builder for upstream pages. html.parser is what the
+# cleaned output has always been produced with; 'lxml' is faster but repairs
+# broken markup (unclosed <p> and <li>, stray end tags) differently, so it
+# changes the saved HTML and has to be chosen explicitly.
+HTML_PARSER = resolve_parser(os.getenv('HTML_PARSER', 'html.parser'))
+
+UNWANTED_TAGS = ['script', 'style', 'iframe', 'noscript']
+EXTENSION_PATTERN = re.compile(r'\.[^.]+$')
+
+def remove_unwanted_elements(content_div):
+    """Remove scripts, styles, iframes and noscript blocks."""
+    for element in content_div(UNWANTED_TAGS):
+        element.decompose()
+
+def remove_comments(content_div):
+    """Remove HTML comments."""
+    for comment in content_div.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+
+def replace_title_link(title):
+    """Turn a title wrapping a link into a plain title with the link text, in place."""
+    title_text = title.find('a').get_text(strip=True)
+    title.attrs = {}
+    title.string = title_text
 
 def clean_sunday_homily(content_div):
     """Clean Sunday Homily specific content."""
     if not content_div:
         return
 
-    # Create a new BeautifulSoup object with the same parser
-    soup = BeautifulSoup("", "html.parser")
-    
     # Remove the "Sunday Homily" header
     header = content_div.find('h2', class_='inner_title')
     if header:
@@ -45,20 +54,13 @@ def clean_sunday_homily(content_div):
     # Transform post title links into plain titles
     title = content_div.find('h1', class_='title')
     if title and title.find('a'):
-        link = title.find('a')
-        title_text = link.get_text(strip=True)
-        new_title = soup.new_tag('h1')
-        new_title.string = title_text
-        title.replace_with(new_title)
+        replace_title_link(title)
 
 def clean_saint_of_day(content_div):
     """Clean Saint of the Day specific content."""
     if not content_div:
         return
 
-    # Create a new BeautifulSoup object with the same parser
-    soup = BeautifulSoup("", "html.parser")
-    
     # Remove the "Saint of the day" header
     header = content_div.find('h2', class_='inner_title')
     if header:
@@ -71,12 +73,8 @@ def clean_saint_of_day(content_div):
         title = content_div.find('h1', class_='title')
     
     if title and title.find('a'):
-        link = title.find('a')
-        title_text = link.get_text(strip=True)
-        # Use the same tag type as the original (h1 or h2)
-        new_title = soup.new_tag(title.name)
-        new_title.string = title_text
-        title.replace_with(new_title)
+        # Keeps the same tag type as the original (h1 or h2)
+        replace_title_link(title)
     
     # Remove the archive link section
     archive_link = content_div.find('span', class_='more')
@@ -94,9 +92,9 @@ def transform_images(content_div):
     """Transform image tags into WordPress block format."""
     if not content_div:
         return
-        
-    # Create a new BeautifulSoup object with the same parser
-    soup = BeautifulSoup("", "html.parser")
+
+    # New tags are created by the document that owns content_div
+    soup = next(parent for parent in content_div.parents if isinstance(parent, BeautifulSoup))
     
     for img in content_div.find_all('img'):
         try:
@@ -119,7 +117,7 @@ def transform_images(content_div):
             # Generate srcset (placeholder values since we can't generate actual resized images)
             src = img.get('src', '')
             if src:
-                base_url = re.sub(r'\.[^.]+$', '', src)
+                base_url = EXTENSION_PATTERN.sub('', src)
                 img['srcset'] = f"{src} 1120w, {base_url}-300x175.jpg 300w, {base_url}-1024x597.jpg 1024w, {base_url}-768x448.jpg 768w, {base_url}-200x117.jpg 200w"
                 img['sizes'] = "(max-width: 1120px) 100vw, 1120px"
             
@@ -130,121 +128,227 @@ def transform_images(content_div):
             print(f"Error transforming image: {e}")
             continue
 
-def scrape_content(key):
-    """Scrape content for a given key and return cleaned HTML content."""
-    if key not in URLS:
-        print(f"Invalid key '{key}'. Valid keys are: {', '.join(URLS.keys())}")
+# Cleaning steps a source can name in its "cleaners" list
+CLEANING_STEPS = {
+    'remove_unwanted_elements': remove_unwanted_elements,
+    'remove_comments': remove_comments,
+    'clean_sunday_homily': clean_sunday_homily,
+    'clean_saint_of_day': clean_saint_of_day,
+    'transform_images': transform_images,
+}
+
+def cleaning_pipeline(source):
+    """Return the cleaning steps for a source. Each step modifies the content div in place."""
+    unknown = [name for name in source.cleaners if name not in CLEANING_STEPS]
+    if unknown:
+        raise ValueError(f"Source '{source.key}' has unknown cleaners: {', '.join(unknown)}.")
+    return [CLEANING_STEPS[name] for name in source.cleaners]
+
+# Every source's cleaning steps, resolved once at startup
+PIPELINES = {key: cleaning_pipeline(source) for key, source in SOURCES.items()}
+
+def clean_page(key, html):
+    """Parse a page once, select the content for key and return it as cleaned HTML."""
+    source = SOURCES[key]
+    soup = BeautifulSoup(html, HTML_PARSER)
+    content_div = source.selector.select_one(soup)
+    if not content_div:
+        return 'No content found.'
+
+    for step in PIPELINES[key]:
+        step(content_div)
+
+    # Remove the source's strip_patterns, such as mentions of 'Catholic Ireland'
+    cleaned = str(content_div)
+    for pattern in source.strip_patterns:
+        cleaned = pattern.sub('', cleaned)
+    return cleaned
+
+def fetch_page(url, key, store=None):
+    """Fetch url for key, revalidating against the previous fetch when store is given.
+
+    Returns (response, None) when the page has to be parsed, or (None, previous)
+    with the previously saved content when upstream reports it unchanged.
+    """
+    response = fetch(url, store)
+    if response is not None:
+        return response, None
+
+    from storage import load_data
+    previous = load_data(store, key)
+    if previous:
+        print(f"{url} has not changed")
+        return None, previous
+    # Nothing saved to fall back on; fetch the page again unconditionally
+    return fetch(url), None
+
+class MassReadings(NamedTuple):
+    """The readings of one day's Mass. Citations and texts are keyed by reading."""
+    first_reading: Optional[str]
+    psalm: Optional[str]
+    second_reading: Optional[str]
+    gospel_acclamation: Optional[str]
+    gospel: Optional[str]
+    celebration: Optional[str]
+    colour: Optional[str]
+    texts: Dict[str, str]
+
+# Reading headings on the universalis mass page, lowercased
+READING_LABELS = {
+    'first reading': 'first_reading',
+    'responsorial psalm': 'psalm',
+    'second reading': 'second_reading',
+    'gospel acclamation': 'gospel_acclamation',
+    'gospel': 'gospel',
+}
+COLOUR_PATTERN = re.compile(r'Liturgical Colou?r:\s*([A-Za-z]+)', re.I)
+# The page footer after the last reading: a rule, a copyright notice or a footer element
+END_MARKER_TAGS = {'hr', 'footer'}
+END_MARKER_TEXT = re.compile(r'^(?:Copyright\b|©)', re.I)
+END_MARKER_ATTRIBUTE = re.compile(r'copyright|footer', re.I)
+
+def reading_citation(th):
+    """Return the citation shown next to (or below) a reading heading."""
+    sibling_th = th.find_next_sibling('th', align='right')
+    if sibling_th:
+        return sibling_th.get_text(strip=True)
+    parent_tr = th.find_parent('tr')
+    next_tr = parent_tr.find_next_sibling('tr') if parent_tr else None
+    right_th = next_tr.find('th', align='right') if next_tr else None
+    if right_th:
+        return right_th.get_text(strip=True)
+    return None
+
+def ends_readings(element, text):
+    """Tell whether a sibling of the reading tables, with the given text, starts the page footer."""
+    if END_MARKER_TEXT.match(text):
+        return True
+    if not hasattr(element, 'get'):
+        return False
+    attributes = ' '.join([element.get('id') or ''] + element.get('class', []))
+    return element.name in END_MARKER_TAGS or bool(END_MARKER_ATTRIBUTE.search(attributes))
+
+def parse_mass_reading_details(html):
+    """Parse a universalis mass page into a MassReadings record in one pass over its headings.
+
+    The text of each reading is everything between its heading table and the
+    next reading's heading table; the last reading ends with its block, or
+    where the page footer starts.
+    """
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    citations = {}
+    tables = []
+    for th in soup.find_all('th'):
+        field = READING_LABELS.get(th.get_text(strip=True).lower())
+        if field and field not in citations:
+            citations[field] = reading_citation(th)
+            tables.append((field, th.find_parent('table') or th))
+
+    texts = {}
+    reading_tables = {id(table) for _, table in tables}
+    for field, table in tables:
+        parts = []
+        for sibling in table.next_siblings:
+            if id(sibling) in reading_tables:
+                break
+            if isinstance(sibling, Comment):
+                continue
+            text = sibling.get_text(' ', strip=True) if hasattr(sibling, 'get_text') else sibling.strip()
+            if ends_readings(sibling, text):
+                break
+            if text:
+                parts.append(text)
+        if parts:
+            texts[field] = '\n'.join(parts)
+
+    feast = soup.find(id='feastname') or soup.find(class_='feast')
+    colour = COLOUR_PATTERN.search(soup.get_text(' '))
+
+    return MassReadings(
+        first_reading=citations.get('first_reading'),
+        psalm=citations.get('psalm'),
+        second_reading=citations.get('second_reading'),
+        gospel_acclamation=citations.get('gospel_acclamation'),
+        gospel=citations.get('gospel'),
+        celebration=feast.get_text(' ', strip=True) if feast else None,
+        colour=colour.group(1).lower() if colour else None,
+        texts=texts,
+    )
+
+def parse_page(key, html):
+    """Turn a fetched page into the content saved for key, as its source's parser says."""
+    if SOURCES[key].parser == 'mass_readings':
+        return parse_mass_reading_details(html)._asdict()
+    return clean_page(key, html)
+
+@track_scrape()
+def scrape_content(key, store=None, day=None):
+    """Scrape content for a given key and return its cleaned HTML, or its details for structured sources.
+
+    If store is given, an unchanged upstream page is not downloaded or
+    parsed again and the previously saved content is returned. If day is
+    given, the content for that date is scraped instead of the current
+    content; this needs a source with a dated_url.
+    """
+    source = SOURCES.get(key)
+    if source is None:
+        print(f"Invalid key '{key}'. Valid keys are: {', '.join(ALL_KEYS)}")
         return None
 
-    item = URLS[key]
-    url = item['url']
-    css_selector = item['css_selector']
+    url = source_url(source, day)
+    if url is None:
+        print(f"No dated pages for '{key}'")
+        return None
+    if day:
+        # Conditional fetches only apply to the current saved content
+        store = None
 
     print(f"Scraping {url}...")
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        content_div = soup.select_one(css_selector)
-        
-        if content_div:
-            # Create a new BeautifulSoup object for the content
-            new_soup = BeautifulSoup(str(content_div), 'html.parser')
-            content_div = new_soup.div
-            
-            # Remove unwanted elements
-            for element in content_div(['script', 'style', 'iframe', 'noscript']):
-                element.decompose()
-            
-            # Remove comments
-            for comment in content_div.find_all(string=lambda text: isinstance(text, Comment)):
-                comment.extract()
-            
-            # Apply specific cleaning based on content type
-            if key == 'sunday_homily':
-                clean_sunday_homily(content_div)
-            elif key == 'saint_of_the_day':
-                clean_saint_of_day(content_div)
-            
-            # Transform images
-            transform_images(content_div)
-            
-            # Remove mentions of 'Catholic Ireland'
-            text = str(content_div)
-            text = re.sub(r'(?i)catholic ireland', '', text)
-            
-            return text
-        else:
-            return 'No content found.'
+        response, previous = fetch_page(url, key, store)
     except requests.RequestException as e:
         print(f"Error fetching content: {e}")
         return None
 
-def scrape_mass_reading_details():
-    """Scrape mass reading details from the specified URL."""
-    url = 'https://www.universalis.com/europe.ireland/0/mass.htm'
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        print(f"Error fetching mass reading details: {e}")
-        return None
+    if response is None:
+        return previous
+    return parse_page(key, response.content)
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-
-    readings = {}
-    reading_fields_map = {
-        'first_reading': 'First reading',
-        'psalm': 'Responsorial Psalm',
-        'second_reading': 'Second reading',
-        'gospel_acclamation': 'Gospel Acclamation',
-        'gospel': 'Gospel'
-    }
-
-    for key, field_label in reading_fields_map.items():
-        th = soup.find('th', text=re.compile(f'^{re.escape(field_label)}$', re.I))
-        if th:
-            sibling_th = th.find_next_sibling('th', align='right')
-            if sibling_th:
-                readings[key] = sibling_th.get_text(strip=True)
-            else:
-                parent_tr = th.find_parent('tr')
-                next_tr = parent_tr.find_next_sibling('tr') if parent_tr else None
-                if next_tr:
-                    right_th = next_tr.find('th', align='right')
-                    if right_th:
-                        readings[key] = right_th.get_text(strip=True)
-                    else:
-                        readings[key] = None
-                else:
-                    readings[key] = None
-        else:
-            readings[key] = None
-
-    return readings
-
-def scrape_all():
-    """Scrape all URLs and save their content."""
+def scrape_all(store, keys=None, max_workers=4):
+    """Scrape the given keys (all keys by default) concurrently and save their content.
+
+    Returns the list of keys that were saved.
+    """
     from storage import save_data
-    for key in URLS.keys():
-        content = scrape_content(key)
-        if content:
-            save_data(key, content)
-            print(f"Saved content under key '{key}'")
+    if keys is None:
+        keys = ALL_KEYS
+
+    saved = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(scrape_content, key, store): key for key in keys}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                content = future.result()
+                if content:
+                    save_data(store, key, content)
+            except Exception as e:
+                print(f"Error scraping '{key}': {e}")
+                content = None
+            if content:
+                saved.append(key)
+                print(f"Saved content under key '{key}'")
+            else:
+                print(f"Failed to scrape content for key '{key}'")
+    return saved
 
 if __name__ == '__main__':
     import argparse
-    from storage import save_data, redis_client
+    from storage import store
 
     parser = argparse.ArgumentParser(description='Scrape content from CatholicIreland.net')
     parser.add_argument('keys', nargs='*', help='Keys to scrape. If none provided, all will be scraped.')
     args = parser.parse_args()
 
-    if args.keys:
-        for key in args.keys:
-            content = scrape_content(key)
-            if content:
-                save_data(redis_client, key, content)
-                print(f"Saved content under key '{key}'")
-    else:
-        scrape_all()
\ No newline at end of file
+    scrape_all(store, args.keys or None)
@@ -0,0 +1,148 @@
+# scripture.py
+
+import re
+
+# Verses are indexed as chapter * VERSE_SCALE + verse, so a passage is one integer range
+VERSE_SCALE = 1000
+
+# The books of the Catholic bible under the names their readings are indexed
+# by, each with its common abbreviations and alternative names, after normalize_book
+BOOKS = {
+    'genesis': ('gn', 'gen'),
+    'exodus': ('ex', 'exod'),
+    'leviticus': ('lv', 'lev'),
+    'numbers': ('nm', 'num'),
+    'deuteronomy': ('dt', 'deut'),
+    'joshua': ('jos', 'josh'),
+    'judges': ('jgs', 'judg'),
+    'ruth': ('ru', 'rt'),
+    '1samuel': ('1sm', '1sam'),
+    '2samuel': ('2sm', '2sam'),
+    '1kings': ('1kgs', '1kg'),
+    '2kings': ('2kgs', '2kg'),
+    '1chronicles': ('1chr', '1chron'),
+    '2chronicles': ('2chr', '2chron'),
+    'ezra': ('ezr',),
+    'nehemiah': ('neh',),
+    'tobit': ('tb', 'tob'),
+    'judith': ('jdt',),
+    'esther': ('est', 'esth'),
+    '1maccabees': ('1mc', '1macc'),
+    '2maccabees': ('2mc', '2macc'),
+    'job': ('jb',),
+    'psalm': ('ps', 'pss', 'psalms'),
+    'proverbs': ('prv', 'prov'),
+    'ecclesiastes': ('eccl', 'eccles', 'qoheleth'),
+    'songofsongs': ('sg', 'song', 'songofsolomon', 'canticleofcanticles'),
+    'wisdom': ('wis', 'ws'),
+    'sirach': ('sir', 'ecclesiasticus', 'ecclus'),
+    'isaiah': ('is', 'isa'),
+    'jeremiah': ('jer',),
+    'lamentations': ('lam',),
+    'baruch': ('bar',),
+    'ezekiel': ('ez', 'ezek'),
+    'daniel': ('dn', 'dan'),
+    'hosea': ('hos',),
+    'joel': ('jl',),
+    'amos': ('am',),
+    'obadiah': ('ob', 'obad'),
+    'jonah': ('jon',),
+    'micah': ('mi', 'mic'),
+    'nahum': ('na', 'nah'),
+    'habakkuk': ('hb', 'hab'),
+    'zephaniah': ('zep', 'zeph'),
+    'haggai': ('hg', 'hag'),
+    'zechariah': ('zec', 'zech'),
+    'malachi': ('mal',),
+    'matthew': ('mt', 'matt'),
+    'mark': ('mk',),
+    'luke': ('lk',),
+    'john': ('jn',),
+    'acts': ('ac', 'actsoftheapostles'),
+    'romans': ('rm', 'rom'),
+    '1corinthians': ('1cor',),
+    '2corinthians': ('2cor',),
+    'galatians': ('gal',),
+    'ephesians': ('eph',),
+    'philippians': ('phil', 'php'),
+    'colossians': ('col',),
+    '1thessalonians': ('1thes', '1thess'),
+    '2thessalonians': ('2thes', '2thess'),
+    '1timothy': ('1tm', '1tim'),
+    '2timothy': ('2tm', '2tim'),
+    'titus': ('ti', 'tit'),
+    'philemon': ('phlm', 'philem'),
+    'hebrews': ('heb',),
+    'james': ('jas',),
+    '1peter': ('1pt', '1pet'),
+    '2peter': ('2pt', '2pet'),
+    '1john': ('1jn',),
+    '2john': ('2jn',),
+    '3john': ('3jn',),
+    'jude': ('jud',),
+    'revelation': ('rv', 'rev', 'apocalypse'),
+}
+BOOK_ALIASES = {alias: book for book, aliases in BOOKS.items() for alias in aliases}
+
+# "1 Corinthians 12:3-7,12-13" -> book "1 Corinthians", passages "12:3-7,12-13"
+REFERENCE_PATTERN = re.compile(r'^\s*((?:[1-3]\s*)?[^\d\s][^\d]*?)\.?\s*(\d.*)$')
+# Grail psalm numbering is followed by the Hebrew number in brackets: "Psalm 33(34)"
+ALTERNATIVE_NUMBER_PATTERN = re.compile(r'\(\d+\)')
+# One passage: "3", "3:16", "3:14-21", "26:14-27:66" or, continuing the previous chapter, "16-19"
+PASSAGE_PATTERN = re.compile(r'^(\d+)[a-z]?(?::(\d+)[a-z]?)?(?:-(\d+)[a-z]?(?::(\d+)[a-z]?)?)?$')
+
+def normalize_book(name):
+    """Normalize a book name for lookups: lowercase, without spaces or dots, with aliases resolved.
+
+    The result is a key of BOOKS if the name is a known book.
+    """
+    book = re.sub(r'[\s.]', '', name.lower())
+    return BOOK_ALIASES.get(book, book)
+
+def parse_reference(text):
+    """Parse a scripture reference into (book, [(first, last), ...]) verse ranges.
+
+    Returns None if the text is not a recognisable reference, or names an unknown book.
+    """
+    if not text:
+        return None
+    match = REFERENCE_PATTERN.match(text)
+    if not match:
+        return None
+    book, passages = match.groups()
+    book = normalize_book(book)
+    if book not in BOOKS:
+        return None
+    passages = ALTERNATIVE_NUMBER_PATTERN.sub('', passages)
+
+    ranges = []
+    chapter = None
+    for passage in re.split(r'[,;]\s*', passages.replace(' ', '')):
+        if not passage:
+            continue
+        match = PASSAGE_PATTERN.match(passage.lower())
+        if not match:
+            return None
+        first, first_verse, last, last_verse = match.groups()
+        if first_verse is None and chapter is not None and ':' not in passage:
+            # "16-19" after "4-7": verses of the chapter already given
+            start = chapter * VERSE_SCALE + int(first)
+            end = chapter * VERSE_SCALE + int(last or first)
+        elif first_verse is None:
+            # Whole chapters: "3" or "3-4"
+            chapter = int(last or first)
+            start = int(first) * VERSE_SCALE
+            end = chapter * VERSE_SCALE + VERSE_SCALE - 1
+        else:
+            chapter = int(first)
+            start = chapter * VERSE_SCALE + int(first_verse)
+            if last_verse is not None:
+                # Runs into a later chapter: "26:14-27:66"
+                chapter = int(last)
+                end = chapter * VERSE_SCALE + int(last_verse)
+            else:
+                end = chapter * VERSE_SCALE + int(last or first_verse)
+        ranges.append((start, end))
+    if not ranges:
+        return None
+    return book, ranges
@@ -0,0 +1,155 @@
+# sources.py
+#
+# The content sources the API serves, loaded once at startup from a JSON
+# registry (sources.json, or the file named by SOURCES_PATH). Each source
+# names its URL, how its page is parsed and cleaned, how long its content
+# stays fresh and when upstream publishes it. Selectors and patterns are
+# compiled here, so a bad registry fails at startup rather than on a
+# request, and adding a site, language or universalis region is a config
+# change.
+#
+# A source entry takes these fields; any of them may be set in "defaults":
+#
+#   url               Page holding the current content. "{region}" is replaced by region.
+#   dated_url         Optional page for a given date: "{region}" and "{date:%Y%m%d}" style fields.
+#   region            Substituted into the URLs, e.g. a universalis region such as "europe.ireland".
+#   parser            "html" (selected and cleaned HTML) or "mass_readings" (structured readings).
+#   css_selector      The content element of an html page.
+#   cleaners          Names of scraper.CLEANING_STEPS run on the content element, in order.
+#   strip_patterns    Regular expressions removed from the cleaned HTML.
+#   ttl, stale_ttl    Seconds before content is refreshed in the background, and before
+#                     a request has to wait for a fresh scrape.
+#   refresh_interval  Seconds between refreshes by refresher.py, whatever the publish schedule.
+#   publish_days      Weekdays (Monday is 0) on which upstream publishes new content.
+#   content_date      "today", or "next_sunday" for content about the coming Sunday.
+#   timezone          Upstream's timezone, for publish times and content dates.
+#   description       Shown on the documentation page.
+
+import os
+import re
+import json
+from datetime import date
+from typing import FrozenSet, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import soupsieve
+
+SOURCES_PATH = os.getenv('SOURCES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sources.json'))
+
+PARSERS = ('html', 'mass_readings')
+CONTENT_DATES = ('today', 'next_sunday')
+# Dates a dated_url is formatted with at startup; it has to give a different page for each
+SAMPLE_DATES = (date(2026, 1, 31), date(2027, 12, 1))
+
+class Source(NamedTuple):
+    """One content source from the registry, with its selector and patterns compiled."""
+    key: str
+    url: str
+    dated_url: Optional[str]
+    region: Optional[str]
+    parser: str
+    css_selector: Optional[str]
+    selector: Optional[soupsieve.SoupSieve]
+    cleaners: Tuple[str, ...]
+    strip_patterns: Tuple[re.Pattern, ...]
+    ttl: int
+    stale_ttl: int
+    refresh_interval: int
+    publish_days: FrozenSet[int]
+    content_date: str
+    timezone: ZoneInfo
+    description: str
+
+def _compile_source(key, config):
+    """Validate one merged source entry and return its Source, raising ValueError if it is invalid."""
+    def require(field):
+        if config.get(field) in (None, ''):
+            raise ValueError(f"Source '{key}' has no '{field}'.")
+        return config[field]
+
+    region = config.get('region')
+    url = require('url')
+    dated_url = config.get('dated_url') or None
+    for field, value in (('url', url), ('dated_url', dated_url)):
+        if value and '{region}' in value and not region:
+            raise ValueError(f"Source '{key}' uses {{region}} in its {field} but has no 'region'.")
+    if dated_url:
+        try:
+            samples = {dated_url.format(region=region or '', date=day) for day in SAMPLE_DATES}
+        except (KeyError, IndexError, AttributeError, ValueError) as e:
+            raise ValueError(f"Source '{key}' has an invalid dated_url: {e!r}") from e
+        if len(samples) < len(SAMPLE_DATES):
+            raise ValueError(f"Source '{key}' has a dated_url without a {{date}} field.")
+
+    parser = config.get('parser', 'html')
+    if parser not in PARSERS:
+        raise ValueError(f"Source '{key}' has unknown parser '{parser}'. Use one of: {', '.join(PARSERS)}.")
+    css_selector = require('css_selector') if parser == 'html' else config.get('css_selector')
+    try:
+        selector = soupsieve.compile(css_selector) if css_selector else None
+        strip_patterns = tuple(re.compile(pattern) for pattern in config.get('strip_patterns', ()))
+    except (soupsieve.SelectorSyntaxError, re.error) as e:
+        raise ValueError(f"Source '{key}' has an invalid selector or pattern: {e}") from e
+
+    content_date = config.get('content_date', 'today')
+    if content_date not in CONTENT_DATES:
+        raise ValueError(f"Source '{key}' has unknown content_date '{content_date}'. Use one of: {', '.join(CONTENT_DATES)}.")
+    publish_days = frozenset(config.get('publish_days', range(7)))
+    if not publish_days or not publish_days <= set(range(7)):
+        raise ValueError(f"Source '{key}' needs publish_days between 0 (Monday) and 6 (Sunday).")
+    try:
+        timezone = ZoneInfo(config.get('timezone', 'UTC'))
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Source '{key}' has an unknown timezone: {e}") from e
+
+    ttl, stale_ttl = int(require('ttl')), int(require('stale_ttl'))
+    if not 0 < ttl <= stale_ttl:
+        raise ValueError(f"Source '{key}' needs 0 < ttl <= stale_ttl.")
+
+    return Source(
+        key=key,
+        url=url.replace('{region}', region or ''),
+        dated_url=dated_url,
+        region=region,
+        parser=parser,
+        css_selector=css_selector,
+        selector=selector,
+        cleaners=tuple(config.get('cleaners', ())),
+        strip_patterns=strip_patterns,
+        ttl=ttl,
+        stale_ttl=stale_ttl,
+        refresh_interval=int(require('refresh_interval')),
+        publish_days=publish_days,
+        content_date=content_date,
+        timezone=timezone,
+        description=config.get('description') or f'Get the {key.replace("_", " ")} content.',
+    )
+
+def load_sources(path=SOURCES_PATH):
+    """Load the source registry at path into a dict of Source records, in file order."""
+    with open(path, encoding='utf-8') as f:
+        registry = json.load(f)
+    defaults = registry.get('defaults', {})
+    sources = {}
+    for key, config in registry.get('sources', {}).items():
+        if not re.fullmatch(r'[a-z0-9_]+', key):
+            raise ValueError(f"Invalid source key '{key}'. Use lowercase letters, digits and underscores.")
+        sources[key] = _compile_source(key, {**defaults, **config})
+    if not sources:
+        raise ValueError(f"No sources defined in {path}.")
+    return sources
+
+SOURCES = load_sources()
+# Every key the API serves
+ALL_KEYS = list(SOURCES)
+
+def source_url(source, day=None):
+    """Return the URL of a source's current page, or of its page for day (None if it has no dated pages)."""
+    if day is None:
+        return source.url
+    if not source.dated_url:
+        return None
+    return source.dated_url.format(region=source.region or '', date=day)
+
+def source_ttls(keys):
+    """Return {key: (ttl, stale_ttl)} for the given keys, as get_many_data takes them."""
+    return {key: (SOURCES[key].ttl, SOURCES[key].stale_ttl) for key in keys}
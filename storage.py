@@ -2,41 +2,491 @@
 
 import time
 import json
-from redis_client import redis_client
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from backends import create_backend
+from redis_client import redis_available, mark_unavailable, UNAVAILABLE_ERRORS
+from archive import archive_data, archive_executor, content_date, load_archived
+from metrics import CACHE_LOOKUPS, observe_payload, track_storage
 
-def save_data(redis_client, key, data):
-    """Save data under the given key to Redis with a timestamp."""
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The backend selected by STORAGE_BACKEND; every function here takes the store to use
+store = create_backend()
+
+# How long a scrape lease is held before the store expires it (seconds)
+LEASE_TIMEOUT = 60
+# How long a worker waits for another worker's scrape to finish (seconds)
+LEASE_WAIT = 20
+LEASE_POLL_INTERVAL = 0.1
+
+# Dated pages that could not be scraped into the archive are not tried
+# again by this process for this long (seconds)
+FILL_IN_RETRY_INTERVAL = 300
+# (key, date) -> time.monotonic() of the failed fill-in
+_failed_fill_ins = {}
+
+# Background refreshes of stale keys run on a small per-process pool.
+# At most one refresh per key is queued, so the queue stays bounded.
+REFRESH_WORKERS = 2
+refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='refresh')
+_pending_refreshes = set()
+_pending_lock = threading.Lock()
+
+# Per-process cache of parsed entries in front of the store. Each entry
+# remembers the version it was loaded at; save_data changes that version, so
+# other workers drop the entry at their next version check.
+L1_MAX_ENTRIES = 64
+# How long an entry is trusted before its version is checked again (seconds)
+L1_CHECK_INTERVAL = 1.0
+_l1_cache = OrderedDict()
+_l1_lock = threading.Lock()
+# Version of entries cached while Redis was unreachable. It matches no stored
+# version, so they are replaced by what Redis holds once it is back.
+LOCAL_VERSION = ''
+
+def build_responses(data):
+    """Build the ready-to-send JSON response body for data, its compressed variants and an ETag."""
+    body = json.dumps({'content': data}, separators=(',', ':')).encode('utf-8')
+    responses = {
+        'identity': body,
+        'gzip': gzip.compress(body, mtime=0),
+        'etag': hashlib.sha256(body).hexdigest()[:32],
+    }
+    if brotli:
+        responses['br'] = brotli.compress(body)
+    return responses
+
+def _saved_entry(key, data):
+    """Return the entry and response bodies saving data under key stores."""
     content = {
         'content': data,
         'timestamp': time.time()
     }
-    redis_client.set(key, json.dumps(content))
-
-def load_data(redis_client, key):
-    """Load data for the given key from Redis."""
-    value = redis_client.get(key)
-    if value:
-        content = json.loads(value)
-        return content['content']
+    responses = build_responses(data)
+    observe_payload(key, responses)
+    return content, responses
+
+def _archive(key, data):
+    """Queue data for the on-disk archive under its content date, on the archive thread."""
+    archive_executor.submit(_write_archive, key, content_date(key), data)
+
+def _write_archive(key, day, data):
+    """Add data to the on-disk archive, logging rather than raising on failure."""
+    try:
+        archive_data(key, day, data)
+    except Exception as e:
+        print(f"Error archiving '{key}': {e}")
+
+@track_storage('save_data')
+def save_data(store, key, data):
+    """Save data under the given key with a timestamp and precomputed response bodies.
+
+    The data is also queued for the on-disk archive under its content date.
+    Returns the response bodies that were saved.
+    """
+    entry, responses = _saved_entry(key, data)
+    store.save(key, entry, responses)
+    # This process sees its own write straight away
+    with _l1_lock:
+        _l1_cache.pop(key, None)
+    _archive(key, data)
+    return responses
+
+@track_storage('load_data')
+def load_data(store, key):
+    """Load data for the given key from the store."""
+    entry = store.get([key])[0]
+    if entry:
+        return entry['content']
     else:
         return None
 
-def is_data_valid(redis_client, key, max_age_seconds):
+@track_storage('load_entry')
+def load_entry(store, key):
+    """Load data and its timestamp for the given key from the store. Returns (None, None) if missing."""
+    entry = store.get([key])[0]
+    if entry:
+        return entry['content'], entry.get('timestamp', 0)
+    else:
+        return None, None
+
+def load_cached_entry(store, key):
+    """Load data, its timestamp and its response bodies for the given key, using the per-process cache.
+
+    A cached entry checked within L1_CHECK_INTERVAL is returned without touching
+    the store. Otherwise the entry's version is checked, and only a changed or
+    missing entry is reloaded (entry, version and response bodies together).
+    Returns (None, None, None) if missing.
+    """
+    return load_cached_entries(store, [key])[key]
+
+def _l1_lookup(keys, now):
+    """Split keys into cached entries, cached entries due a version check, and keys to load."""
+    entries = {}
+    stale = {}
+    with _l1_lock:
+        for key in keys:
+            cached = _l1_cache.get(key)
+            if not cached:
+                continue
+            _l1_cache.move_to_end(key)
+            content, timestamp, responses, version, checked_at = cached
+            if now - checked_at < L1_CHECK_INTERVAL:
+                entries[key] = (content, timestamp, responses)
+            else:
+                stale[key] = cached
+    missing = [key for key in keys if key not in entries and key not in stale]
+    return entries, stale, missing
+
+def _l1_revalidate(stale, versions, entries, now):
+    """Keep stale cache entries whose version is unchanged. Returns the keys that changed."""
+    changed = []
+    for (key, cached), version in zip(stale.items(), versions):
+        content, timestamp, responses, cached_version, checked_at = cached
+        if version == cached_version:
+            entries[key] = (content, timestamp, responses)
+            with _l1_lock:
+                _l1_cache[key] = (content, timestamp, responses, version, now)
+        else:
+            changed.append(key)
+    return changed
+
+def _l1_store(loaded, entries, now):
+    """Add entries loaded by the store's load() to entries and the cache."""
+    for key, stored in loaded.items():
+        if stored is None:
+            with _l1_lock:
+                _l1_cache.pop(key, None)
+            entries[key] = (None, None, None)
+            continue
+
+        content, timestamp, responses, version = stored
+        if responses is None:
+            # Saved before response bodies were precomputed
+            responses = build_responses(content)
+        entries[key] = (content, timestamp, responses)
+        _l1_put(key, content, timestamp, responses, version, now)
+
+def _l1_put(key, content, timestamp, responses, version, now):
+    """Add an entry to the cache, evicting the least recently used entries over L1_MAX_ENTRIES."""
+    with _l1_lock:
+        _l1_cache[key] = (content, timestamp, responses, version, now)
+        _l1_cache.move_to_end(key)
+        while len(_l1_cache) > L1_MAX_ENTRIES:
+            _l1_cache.popitem(last=False)
+
+@track_storage('load_cached_entries')
+def load_cached_entries(store, keys):
+    """Load several keys like load_cached_entry, in at most two round trips to the store.
+
+    Returns a dict mapping each key to its (content, timestamp, responses) tuple.
+    """
+    now = time.monotonic()
+    entries, stale, missing = _l1_lookup(keys, now)
+    if not stale and not missing:
+        return entries
+
+    # Check the versions of stale cache entries and load missing ones in one round trip
+    versions, loaded = store.load(missing, check=list(stale))
+    if stale:
+        changed = _l1_revalidate(stale, versions, entries, now)
+        # Reload entries that changed since they were cached
+        if changed:
+            loaded.update(store.load(changed)[1])
+
+    _l1_store(loaded, entries, now)
+    return entries
+
+@track_storage('is_data_valid')
+def is_data_valid(store, key, max_age_seconds):
     """Check if the data for the given key is valid (not older than max_age_seconds)."""
-    value = redis_client.get(key)
-    if value:
-        content = json.loads(value)
-        timestamp = content.get('timestamp', 0)
+    entry = store.get([key])[0]
+    if entry:
+        timestamp = entry.get('timestamp', 0)
         age = time.time() - timestamp
         return age < max_age_seconds
     else:
         return False
 
-def load_all_data(redis_client):
-    """Load all data from Redis."""
-    keys = redis_client.keys()
+# Keys read per request by load_all_data
+LOAD_ALL_BATCH = 100
+
+def load_all_data(store):
+    """Load all data from the store."""
     data = {}
-    for key in keys:
-        content = load_data(redis_client, key)
-        data[key] = content
-    return data
\ No newline at end of file
+    batch = []
+    for key in store.keys():
+        batch.append(key)
+        if len(batch) == LOAD_ALL_BATCH:
+            data.update(zip(batch, store.get(batch)))
+            batch = []
+    if batch:
+        data.update(zip(batch, store.get(batch)))
+    return {key: entry['content'] for key, entry in data.items() if entry}
+
+def acquire_lease(store, key):
+    """Try to take the scrape lease for key. Returns a token, or None if another worker holds it."""
+    return store.acquire_lease(key, LEASE_TIMEOUT)
+
+def release_lease(store, key, token):
+    """Release the scrape lease for key if it is still ours."""
+    store.release_lease(key, token)
+
+def _scrape_and_save(store, key, scrape, token):
+    """Run scrape() under an acquired lease and save the result.
+
+    Returns (content, responses), with the response bodies save_data built,
+    or (None, None) if nothing was scraped.
+    """
+    try:
+        content = scrape()
+        if not content:
+            return None, None
+        return content, save_data(store, key, content)
+    finally:
+        release_lease(store, key, token)
+
+def _reload_entry(store, key):
+    """Load key's (content, timestamp, responses) from the store, replacing this process's cached copy."""
+    with _l1_lock:
+        _l1_cache.pop(key, None)
+    return load_cached_entries(store, [key])[key]
+
+def _fresh_entry(store, key, max_age_seconds):
+    """Return key's saved (content, timestamp, responses) if it is younger than max_age_seconds, else None.
+
+    Checked after taking the lease: the previous holder may have saved fresh
+    data since this worker found it missing or stale.
+    """
+    entry = _reload_entry(store, key)
+    if entry[0] is not None and time.time() - entry[1] < max_age_seconds:
+        return entry
+    return None
+
+def refresh_data(store, key, scrape, max_age_seconds):
+    """Scrape and save data for key, letting only one worker scrape at a time.
+
+    The worker holding the lease calls scrape() and saves the result. Other
+    workers wait for it to finish and then read what it saved. If no fresh
+    data turns up, they return the previous value (which may be None).
+    Returns a (content, timestamp, responses) tuple; the response bodies are
+    the ones saved with the content, never rebuilt here.
+    """
+    token = acquire_lease(store, key)
+    if token:
+        fresh = _fresh_entry(store, key, max_age_seconds)
+        if fresh:
+            release_lease(store, key, token)
+            return fresh
+        content, responses = _scrape_and_save(store, key, scrape, token)
+        if content:
+            return content, time.time(), responses
+        return _reload_entry(store, key)
+
+    # Another worker is scraping. Only the lease is polled, as the entry
+    # itself is a full payload; it is read once the lease is released.
+    deadline = time.time() + LEASE_WAIT
+    while time.time() < deadline and store.lease_held(key):
+        time.sleep(LEASE_POLL_INTERVAL)
+    return _reload_entry(store, key)
+
+def schedule_refresh(store, key, scrape, max_age_seconds):
+    """Queue a background refresh of key unless one is already pending in this process.
+
+    The refresh is dropped if, once it holds the lease, the saved entry is
+    younger than max_age_seconds.
+    """
+    with _pending_lock:
+        if key in _pending_refreshes:
+            return False
+        _pending_refreshes.add(key)
+
+    def run():
+        try:
+            token = acquire_lease(store, key)
+            if not token:
+                return
+            if _fresh_entry(store, key, max_age_seconds):
+                # Another worker refreshed it since this one loaded the stale entry
+                release_lease(store, key, token)
+            else:
+                _scrape_and_save(store, key, scrape, token)
+        except Exception as e:
+            print(f"Error refreshing '{key}' in background: {e}")
+        finally:
+            with _pending_lock:
+                _pending_refreshes.discard(key)
+
+    refresh_executor.submit(run)
+    return True
+
+def _fill_in_failed_recently(key, day):
+    failed_at = _failed_fill_ins.get((key, day))
+    return failed_at is not None and time.monotonic() - failed_at < FILL_IN_RETRY_INTERVAL
+
+def _record_fill_in(key, day, content):
+    if content:
+        _failed_fill_ins.pop((key, day), None)
+    else:
+        _failed_fill_ins[(key, day)] = time.monotonic()
+
+def _archive_scraped(key, day, scrape):
+    """Scrape key's content for day and archive it, on the archive thread. Returns the content."""
+    content = scrape()
+    if content:
+        archive_executor.submit(archive_data, key, day, content).result()
+    return content
+
+def fill_in_data(store, key, day, scrape):
+    """Scrape and archive key's content for a day missing from the archive, one worker at a time.
+
+    The lease is taken on key and day together; other workers wait for the
+    holder and then read the archive. Returns the content, or None if it
+    could not be scraped, in which case the day is not tried again for
+    FILL_IN_RETRY_INTERVAL seconds.
+    """
+    if _fill_in_failed_recently(key, day):
+        return None
+    lease_key = f'{key}:{day:%Y%m%d}'
+    token = None
+    if redis_available():
+        try:
+            token = acquire_lease(store, lease_key)
+        except UNAVAILABLE_ERRORS as e:
+            mark_unavailable(e)
+    if token:
+        try:
+            # The previous holder may have archived it since our miss
+            content = load_archived(key, day) or _archive_scraped(key, day, scrape)
+        finally:
+            release_lease(store, lease_key, token)
+    elif not redis_available():
+        # No leases without Redis; this worker scrapes on its own
+        content = _archive_scraped(key, day, scrape)
+    else:
+        # Another worker is scraping; wait for it to archive the day
+        deadline = time.time() + LEASE_WAIT
+        try:
+            while time.time() < deadline and store.lease_held(lease_key):
+                time.sleep(LEASE_POLL_INTERVAL)
+        except UNAVAILABLE_ERRORS as e:
+            mark_unavailable(e)
+        content = load_archived(key, day)
+    _record_fill_in(key, day, content)
+    return content
+
+def get_data(store, key, scrape, soft_ttl, hard_ttl):
+    """Get data for key, serving stale data while it is refreshed in the background.
+
+    Data younger than soft_ttl is returned as is. Data between soft_ttl and
+    hard_ttl is returned right away and a background refresh is queued.
+    Missing data, or data older than hard_ttl, is scraped before returning.
+    Returns a (content, age_seconds, responses) tuple, where responses holds the
+    precomputed response bodies from build_responses; content is None if
+    nothing could be loaded.
+    """
+    return get_many_data(store, {key: scrape}, {key: (soft_ttl, hard_ttl)})[key]
+
+def _split_by_age(entries, ttls):
+    """Split loaded entries into results to serve, keys to refresh in the background and keys to scrape now.
+
+    ttls maps each key to its (soft_ttl, hard_ttl).
+    """
+    results = {}
+    to_refresh = []
+    to_scrape = []
+    for key, (content, timestamp, responses) in entries.items():
+        if content is not None:
+            soft_ttl, hard_ttl = ttls[key]
+            age = time.time() - timestamp
+            if age < hard_ttl:
+                if age >= soft_ttl:
+                    CACHE_LOOKUPS.labels(key=key, result='stale').inc()
+                    to_refresh.append(key)
+                else:
+                    CACHE_LOOKUPS.labels(key=key, result='hit').inc()
+                results[key] = (content, age, responses)
+                continue
+        CACHE_LOOKUPS.labels(key=key, result='miss').inc()
+        to_scrape.append(key)
+    return results, to_refresh, to_scrape
+
+def _scraped_result(content, timestamp, responses):
+    """Turn a refresh_data result into a (content, age_seconds, responses) tuple."""
+    if content is None:
+        return None, None, None
+    return content, max(time.time() - timestamp, 0), responses
+
+def get_many_data(store, scrapes, ttls):
+    """Get data for several keys like get_data, reading them from the store together.
+
+    scrapes maps each key to its scrape function and ttls maps it to its
+    (soft_ttl, hard_ttl), so every key keeps its own freshness. Keys that have to be scraped
+    before returning are scraped concurrently. Returns a dict mapping each key
+    to its (content, age_seconds, responses) tuple. While Redis is unreachable
+    the keys are served by get_local_data instead.
+    """
+    if redis_available():
+        try:
+            return _get_many_data(store, scrapes, ttls)
+        except UNAVAILABLE_ERRORS as e:
+            mark_unavailable(e)
+    return get_local_data(scrapes, ttls)
+
+def _get_many_data(store, scrapes, ttls):
+    entries = load_cached_entries(store, list(scrapes))
+    results, to_refresh, to_scrape = _split_by_age(entries, ttls)
+    for key in to_refresh:
+        schedule_refresh(store, key, scrapes[key], ttls[key][0])
+
+    if to_scrape:
+        with ThreadPoolExecutor(max_workers=len(to_scrape)) as executor:
+            futures = {key: executor.submit(refresh_data, store, key, scrapes[key], ttls[key][0]) for key in to_scrape}
+        for key, future in futures.items():
+            results[key] = _scraped_result(*future.result())
+    return results
+
+def _hard_ttls(ttls):
+    """Return ttls with each soft_ttl raised to the hard_ttl, so nothing is refreshed in the background."""
+    return {key: (hard_ttl, hard_ttl) for key, (_, hard_ttl) in ttls.items()}
+
+def _local_entries(keys):
+    """Return the cached entry for each key however old it is, or (None, None, None)."""
+    with _l1_lock:
+        return {key: _l1_cache[key][:3] if key in _l1_cache else (None, None, None) for key in keys}
+
+def _local_result(key, content, previous):
+    """Cache content scraped while Redis is unreachable and return its result.
+
+    If the scrape failed, the previous entry is returned however old it is.
+    """
+    if content:
+        responses = build_responses(content)
+        _l1_put(key, content, time.time(), responses, LOCAL_VERSION, time.monotonic())
+        return content, 0, responses
+    content, timestamp, responses = previous
+    if content is None:
+        return None, None, None
+    return content, time.time() - timestamp, responses
+
+def get_local_data(scrapes, ttls):
+    """Get data for several keys from the per-process cache alone, for when Redis is unreachable.
+
+    Cached entries younger than their hard_ttl are served; other keys are scraped
+    and cached in this process without a lease, and are not saved.
+    """
+    entries = _local_entries(scrapes)
+    results, _, to_scrape = _split_by_age(entries, _hard_ttls(ttls))
+    if to_scrape:
+        with ThreadPoolExecutor(max_workers=len(to_scrape)) as executor:
+            futures = {key: executor.submit(scrapes[key]) for key in to_scrape}
+        for key, future in futures.items():
+            results[key] = _local_result(key, future.result(), entries[key])
+    return results
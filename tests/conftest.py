@@ -0,0 +1,22 @@
+# tests/conftest.py
+#
+# The modules under test read their configuration from the environment at
+# import time, so it is set here before any test imports them. Tests build
+# their own stores (MemoryBackend, or RedisBackend over fakeredis) and never
+# need a Redis server or the network.
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+API_KEY = 'test-key'
+
+os.environ['API_KEYS'] = API_KEY
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['ARCHIVE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='archive-'), 'archive.sqlite3')
+os.environ['ROUTE_LIMIT'] = str(10 ** 9)
+os.environ['DEFAULT_LIMIT'] = str(10 ** 9)
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+os.environ.pop('HTML_PARSER', None)
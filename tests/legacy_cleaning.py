@@ -0,0 +1,67 @@
+# tests/legacy_cleaning.py
+#
+# The cleaning code as it was before scraper.clean_page: the reference that
+# tests/test_clean_page.py and benchmarks/bench_clean_page.py compare against.
+
+import re
+
+from bs4 import BeautifulSoup, Comment
+
+import scraper
+
+def legacy_replace_title(title, name):
+    soup = BeautifulSoup("", "html.parser")
+    new_title = soup.new_tag(name)
+    new_title.string = title.find('a').get_text(strip=True)
+    title.replace_with(new_title)
+
+def legacy_clean_page(key, html):
+    """The cleaning code as it was before clean_page: two full parses and a throwaway soup per cleaner."""
+    soup = BeautifulSoup(html, 'html.parser')
+    content_div = soup.select_one(scraper.SOURCES[key].css_selector)
+    if not content_div:
+        return 'No content found.'
+    content_div = BeautifulSoup(str(content_div), 'html.parser').div
+
+    for element in content_div(['script', 'style', 'iframe', 'noscript']):
+        element.decompose()
+    for comment in content_div.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+
+    if key in ('sunday_homily', 'saint_of_the_day'):
+        header = content_div.find('h2', class_='inner_title')
+        if header:
+            header.decompose()
+        title = content_div.find('h1', class_='title')
+        if key == 'saint_of_the_day':
+            title = content_div.find('h2', class_='title') or title
+        if title and title.find('a'):
+            legacy_replace_title(title, 'h1' if key == 'sunday_homily' else title.name)
+    if key == 'saint_of_the_day':
+        archive_link = content_div.find('span', class_='more')
+        if archive_link and archive_link.find_parent('div'):
+            archive_link.find_parent('div').decompose()
+        hr = content_div.find('hr', class_='softd-sep')
+        if hr:
+            hr.decompose()
+
+    for img in content_div.find_all('img'):
+        figure = BeautifulSoup("", "html.parser").new_tag('figure', attrs={
+            'class': 'wp-block-image aligncenter size-full is-resized'
+        })
+        img['decoding'] = 'async'
+        if not img.get('width'):
+            img['width'] = '1120'
+        if not img.get('height'):
+            img['height'] = '653'
+        img['class'] = 'wp-image-117'
+        img['style'] = 'aspect-ratio:1.5;object-fit:contain;width:335px;height:auto'
+        src = img.get('src', '')
+        if src:
+            base_url = re.sub(r'\.[^.]+$', '', src)
+            img['srcset'] = f"{src} 1120w, {base_url}-300x175.jpg 300w, {base_url}-1024x597.jpg 1024w, {base_url}-768x448.jpg 768w, {base_url}-200x117.jpg 200w"
+            img['sizes'] = "(max-width: 1120px) 100vw, 1120px"
+        if img.parent:
+            img.wrap(figure)
+
+    return re.sub(r'(?i)catholic ireland', '', str(content_div))
@@ -0,0 +1,126 @@
+# tests/test_archive.py
+#
+# The archive schema is set up once per process and written from one
+# long-lived thread. Days missing from it are filled in from dated pages
+# only near the current date, by one worker at a time, and a day that could
+# not be scraped is not tried again straight away.
+
+import time
+import asyncio
+import threading
+from datetime import timedelta
+
+import pytest
+
+import app as api
+import archive
+import async_storage
+import storage
+from backends import AsyncBackend, FileBackend, MemoryBackend
+from conftest import API_KEY
+from test_single_flight import CLIENTS, get_concurrently
+
+KEY = 'mass_reading_details'
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    store = MemoryBackend()
+    monkeypatch.setattr(api, 'store', store)
+    monkeypatch.setattr(storage, '_failed_fill_ins', {})
+    return store
+
+@pytest.fixture
+def scrapes(monkeypatch):
+    """Replace the scraper with a slow stub; returns the days it was called for."""
+    calls = []
+    lock = threading.Lock()
+
+    def scrape_content(key, store=None, day=None):
+        with lock:
+            calls.append(day)
+        time.sleep(0.2)
+        return {'celebration': f'Readings for {day.isoformat()}', 'texts': {}}
+
+    monkeypatch.setattr(api, 'scrape_content', scrape_content)
+    return calls
+
+def days_ago(days):
+    return archive.content_date(KEY) - timedelta(days=days)
+
+def get(path):
+    return api.app.test_client().get(path, headers={'X-API-Key': API_KEY})
+
+def test_schema_created_once_per_process(monkeypatch):
+    created = []
+    create_reading_index = archive.create_reading_index
+    monkeypatch.setattr(archive, '_schema_ready', False)
+    monkeypatch.setattr(archive, 'create_reading_index', lambda connection: created.append(1) or create_reading_index(connection))
+
+    # Every new thread opens its own connection
+    threads = [threading.Thread(target=archive.get_connection) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert created == [1]
+
+def test_saved_data_is_archived_on_the_archive_thread(store, monkeypatch):
+    threads = []
+    monkeypatch.setattr(storage, 'archive_data', lambda key, day, data: threads.append(threading.current_thread().name))
+    storage.save_data(store, 'daily_readings', '<p>one</p>')
+    storage.save_data(store, 'daily_readings', '<p>two</p>')
+    archive.archive_executor.submit(lambda: None).result()
+    assert len(threads) == 2
+    assert all(name.startswith('archive') for name in threads)
+
+@pytest.mark.parametrize('day', ['0001-01-01', '9999-12-31'])
+def test_days_far_from_today_are_not_scraped(scrapes, day):
+    assert get(f'/api/v1/content/{KEY}/{day}').status_code == 404
+    assert scrapes == []
+
+def test_days_without_dated_pages_are_not_filled_in():
+    assert not archive.can_fill_in('daily_readings', archive.content_date('daily_readings') - timedelta(days=1))
+
+def test_concurrent_fill_ins_scrape_once(scrapes):
+    day = days_ago(10)
+    assert get_concurrently(f'/api/v1/content/{KEY}/{day.isoformat()}') == [200] * CLIENTS
+    assert scrapes == [day]
+    # Later requests are served from the archive
+    assert get(f'/api/v1/content/{KEY}/{day.isoformat()}').get_json()['content']['celebration'] == f'Readings for {day.isoformat()}'
+    assert scrapes == [day]
+
+def test_fill_in_with_the_file_backend(scrapes, monkeypatch, tmp_path):
+    # Its leases are lock files named after the lease
+    monkeypatch.setattr(api, 'store', FileBackend(str(tmp_path / 'storage.log')))
+    day = days_ago(13)
+    assert get_concurrently(f'/api/v1/content/{KEY}/{day.isoformat()}') == [200] * CLIENTS
+    assert scrapes == [day]
+
+def test_failed_fill_in_is_not_retried_straight_away(monkeypatch):
+    scraped = []
+    monkeypatch.setattr(api, 'scrape_content', lambda key, store=None, day=None: scraped.append(day))
+    day = days_ago(11)
+    assert get(f'/api/v1/content/{KEY}/{day.isoformat()}').status_code == 404
+    assert get(f'/api/v1/content/{KEY}/{day.isoformat()}').status_code == 404
+    assert scraped == [day]
+
+    monkeypatch.setattr(storage, 'FILL_IN_RETRY_INTERVAL', 0)
+    assert get(f'/api/v1/content/{KEY}/{day.isoformat()}').status_code == 404
+    assert scraped == [day, day]
+
+def test_concurrent_async_fill_ins_scrape_once():
+    store = AsyncBackend(MemoryBackend())
+    day = days_ago(12)
+    scraped = []
+
+    async def scrape():
+        scraped.append(day)
+        await asyncio.sleep(0.2)
+        return {'celebration': f'Readings for {day.isoformat()}', 'texts': {}}
+
+    async def main():
+        return await asyncio.gather(*(async_storage.fill_in_data(store, KEY, day, scrape) for _ in range(CLIENTS)))
+
+    results = asyncio.run(main())
+    assert scraped == [day]
+    assert all(content['celebration'] == f'Readings for {day.isoformat()}' for content in results)
@@ -0,0 +1,101 @@
+# tests/test_async_cache.py
+#
+# The async app serves many requests per process at once; requests that find
+# the per-process cache due a version check together must share one load.
+
+import asyncio
+import threading
+
+import async_storage
+import storage
+from backends import AsyncBackend, MemoryBackend
+
+class CountingBackend(AsyncBackend):
+    """AsyncBackend that counts load() calls and yields to the loop inside each, like a network round trip."""
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.loads = 0
+
+    async def load(self, keys, check=()):
+        self.loads += 1
+        await asyncio.sleep(0.01)
+        return self.backend.load(keys, check)
+
+def test_concurrent_version_checks_share_one_load(monkeypatch):
+    sync_store = MemoryBackend()
+    storage.save_data(sync_store, 'daily_readings', '<p>one</p>')
+    store = CountingBackend(sync_store)
+    storage._l1_cache.clear()
+
+    async def main():
+        await async_storage.load_cached_entries(store, ['daily_readings'])
+        assert store.loads == 1
+        # Every cached entry is now due a version check
+        monkeypatch.setattr(storage, 'L1_CHECK_INTERVAL', 0)
+        results = await asyncio.gather(*(async_storage.load_cached_entries(store, ['daily_readings']) for _ in range(50)))
+        return results
+
+    results = asyncio.run(main())
+    assert store.loads == 2
+    assert all(entries['daily_readings'][0] == '<p>one</p>' for entries in results)
+    storage._l1_cache.clear()
+
+def test_background_refresh_skips_data_refreshed_meanwhile():
+    sync_store = MemoryBackend()
+    storage.save_data(sync_store, 'daily_readings', '<p>fresh</p>')
+    store = AsyncBackend(sync_store)
+    scraped = []
+
+    async def scrape():
+        scraped.append(1)
+
+    async def main():
+        assert async_storage.schedule_refresh(store, 'daily_readings', scrape, 60)
+        await asyncio.gather(*async_storage._refresh_tasks)
+
+    asyncio.run(main())
+    assert scraped == []
+    assert not sync_store.lease_held('daily_readings')
+
+def test_waiters_poll_the_lease_not_the_entry():
+    sync_store = MemoryBackend()
+    store = AsyncBackend(sync_store)
+    reads = []
+    get, load = sync_store.get, sync_store.load
+    sync_store.get = lambda keys: reads.append(keys) or get(keys)
+    sync_store.load = lambda keys, check=(): (keys and reads.append(keys)) or load(keys, check)
+
+    async def main():
+        token = await async_storage.acquire_lease(store, 'daily_readings')
+        waiter = asyncio.ensure_future(async_storage.refresh_data(store, 'daily_readings', None, 60))
+        await asyncio.sleep(10 * storage.LEASE_POLL_INTERVAL)
+        await async_storage.save_data(store, 'daily_readings', '<p>scraped</p>')
+        await async_storage.release_lease(store, 'daily_readings', token)
+        return await waiter
+
+    content, _, _ = asyncio.run(main())
+    assert content == '<p>scraped</p>'
+    # The entry is read once, after the lease is released
+    assert len(reads) == 1
+
+def test_concurrent_misses_build_responses_once_off_the_loop(monkeypatch):
+    store = AsyncBackend(MemoryBackend())
+    storage._l1_cache.clear()
+    threads = []
+    build_responses = storage.build_responses
+    monkeypatch.setattr(storage, 'build_responses', lambda data: threads.append(threading.current_thread()) or build_responses(data))
+
+    async def scrape():
+        await asyncio.sleep(0.1)
+        return '<p>scraped</p>'
+
+    async def main():
+        return await asyncio.gather(*(async_storage.get_data(store, 'daily_readings', scrape, 60, 120) for _ in range(20)))
+
+    results = asyncio.run(main())
+    assert all(responses['identity'] == results[0][2]['identity'] for _, _, responses in results)
+    # Built once, by save_data, on a worker thread
+    assert len(threads) == 1
+    assert threads[0] is not threading.main_thread()
+    storage._l1_cache.clear()
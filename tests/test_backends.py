@@ -0,0 +1,142 @@
+# tests/test_backends.py
+#
+# Every storage backend in backends.py has to behave the same way, so each
+# check runs against the memory backend, the file backend and the Redis
+# backend over fakeredis.
+
+import os
+import time
+
+import fakeredis
+import pytest
+
+import backends
+from storage import build_responses
+
+PAYLOAD = '<div class="article">' + 'Reading text. ' * 1500 + '</div>'
+
+def entry(content):
+    return {'content': content, 'timestamp': time.time()}
+
+def save(backend, key, content):
+    backend.save(key, entry(content), build_responses(content))
+
+def make_backend(name, directory, ttl=backends.STORAGE_TTL):
+    if name == 'memory':
+        return backends.MemoryBackend(ttl)
+    if name == 'file':
+        return backends.FileBackend(os.path.join(directory, f'storage-{ttl}.log'), ttl)
+    return backends.RedisBackend(fakeredis.FakeRedis(decode_responses=True), ttl)
+
+@pytest.fixture(params=['memory', 'file', 'redis'])
+def backend(request, tmp_path):
+    return make_backend(request.param, str(tmp_path))
+
+def test_entries(backend):
+    assert backend.get(['missing']) == [None]
+    assert backend.load(['missing'], check=['missing']) == ([None], {'missing': None})
+
+    save(backend, 'a', '<p>a</p>')
+    save(backend, 'b', {'gospel': 'John 3:16'})
+    first, second = backend.get(['a', 'b'])
+    assert first['content'] == '<p>a</p>' and second['content'] == {'gospel': 'John 3:16'}
+    assert time.time() - first['timestamp'] < 5
+
+    versions, loaded = backend.load(['a'], check=['b'])
+    content, timestamp, responses, version = loaded['a']
+    assert content == '<p>a</p>'
+    assert responses == build_responses('<p>a</p>')
+    assert len(versions) == 1 and versions[0] is not None
+
+    save(backend, 'a', '<p>a2</p>')
+    _, loaded = backend.load(['a'])
+    assert loaded['a'][0] == '<p>a2</p>'
+    # Saving changes the version
+    assert loaded['a'][3] != version
+    assert isinstance(loaded['a'][3], str)
+
+def test_etags(backend):
+    save(backend, 'a', '<p>a</p>')
+    assert backend.etags(['a', 'missing']) == [build_responses('<p>a</p>')['etag'], None]
+    save(backend, 'a', '<p>a2</p>')
+    assert backend.etags(['a']) == [build_responses('<p>a2</p>')['etag']]
+
+def test_keys_leave_out_internal_entries(backend):
+    save(backend, 'a', '<p>a</p>')
+    backend.save_validators('https://example.com/', {'etag': '"x"'})
+    keys = set(backend.keys())
+    assert keys == {'a'}
+
+@pytest.mark.parametrize('name', ['lease', 'mass_reading_details:20261017', 'mass_reading_details/2026-10-17'])
+def test_leases(backend, name):
+    token = backend.acquire_lease(name, 60)
+    assert token
+    assert backend.acquire_lease(name, 60) is None
+    assert backend.lease_held(name)
+    backend.release_lease(name, 'not-the-token')
+    assert backend.lease_held(name)
+    backend.release_lease(name, token)
+    assert not backend.lease_held(name)
+    token = backend.acquire_lease(name, 60)
+    assert token
+    backend.release_lease(name, token)
+
+def test_validators(backend):
+    assert backend.load_validators('https://example.com/missing') == {}
+    backend.save_validators('https://example.com/', {'etag': '"1"', 'last_modified': 'Sat, 17 Oct 2026 06:00:00 GMT'})
+    assert backend.load_validators('https://example.com/') == {'etag': '"1"', 'last_modified': 'Sat, 17 Oct 2026 06:00:00 GMT'}
+    backend.save_validators('https://example.com/', {})
+    assert backend.load_validators('https://example.com/') == {}
+
+def test_tokens(backend):
+    assert abs(backend.take_tokens('quota', 10, 10 / 3600, 3) - 7) < 0.1
+    assert backend.take_tokens('quota', 10, 10 / 3600, 10) < 0
+
+@pytest.mark.parametrize('name', ['memory', 'file', 'redis'])
+def test_expiry(name, tmp_path):
+    backend = make_backend(name, str(tmp_path), ttl=1)
+    save(backend, 'expiring', '<p>soon gone</p>')
+    time.sleep(1.1)
+    assert backend.get(['expiring']) == [None]
+    assert backend.load(['expiring'])[1] == {'expiring': None}
+    assert backend.etags(['expiring']) == [None]
+    assert 'expiring' not in set(backend.keys())
+
+def test_updates(backend):
+    # Saves are published on UPDATES_CHANNEL by Redis, and returned by poll_updates otherwise
+    if isinstance(backend, backends.RedisBackend):
+        pubsub = backend.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(backends.UPDATES_CHANNEL)
+        save(backend, 'updated', '<p>u</p>')
+        message = pubsub.get_message(timeout=1)
+        while message is None or message['data'] != 'updated':
+            message = pubsub.get_message(timeout=1)
+            assert message is not None, 'save was not published'
+        pubsub.close()
+        return
+    backend.poll_updates()
+    save(backend, 'updated', '<p>u</p>')
+    assert 'updated' in backend.poll_updates()
+    assert 'updated' not in backend.poll_updates()
+
+def test_file_shared_between_processes(tmp_path):
+    # Two FileBackends on one file stand in for two processes
+    path = str(tmp_path / 'shared.log')
+    writer, reader = backends.FileBackend(path), backends.FileBackend(path)
+    save(writer, 'shared', '<p>1</p>')
+    assert reader.get(['shared'])[0]['content'] == '<p>1</p>'
+    token = writer.acquire_lease('shared', 60)
+    assert reader.acquire_lease('shared', 60) is None
+    writer.release_lease('shared', token)
+
+    # Rewriting one key past COMPACT_MIN_SIZE compacts the file under the reader
+    for index in range(backends.COMPACT_MIN_SIZE // len(PAYLOAD) + 10):
+        save(writer, 'shared', PAYLOAD + str(index))
+    assert os.path.getsize(path) < backends.COMPACT_MIN_SIZE
+    assert reader.get(['shared'])[0]['content'] == PAYLOAD + str(index)
+    save(reader, 'shared', '<p>from the reader</p>')
+    assert writer.get(['shared'])[0]['content'] == '<p>from the reader</p>'
+    # Saves by one process show up in the other's poll_updates
+    writer.poll_updates()
+    save(reader, 'shared', '<p>again</p>')
+    assert 'shared' in writer.poll_updates()
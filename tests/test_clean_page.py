@@ -0,0 +1,66 @@
+# tests/test_clean_page.py
+#
+# scraper.clean_page parses each page once; its output must stay byte-for-byte
+# what the previous double-parse cleaning code produced. Synthetic pages stand
+# in for upstream, including the broken markup real pages have.
+
+import pytest
+
+import scraper
+from legacy_cleaning import legacy_clean_page
+
+ARTICLE = '''
+<h2 class="inner_title">Sunday Homily</h2>
+<h1 class="title"><a href="/homily/">Love one another</a></h1>
+<h2 class="title"><a href="/saint/">Saint Teresa of Avila</a></h2>
+<p>First paragraph from Catholic Ireland &amp; friends
+<p>Unclosed paragraph with <b>bold <i>and italic</b> text</i>
+<ul><li>one<li>two<li>three</ul>
+<ol><li><p>nested<li>items</ol>
+<!-- a comment -->
+<script>var x = "<p>not markup</p>";</script>
+<style>p { color: red }</style>
+<iframe src="https://example.com/embed"></iframe>
+<noscript><img src="tracker.gif"></noscript>
+<p><img src="https://example.com/images/saint.jpg" alt="Saint"><br>
+<img src="/relative/pic.png" width="300" height="200"></p>
+<table><tr><td>cell<td>other cell</table>
+<div class="wrap"><span class="more"><a href="/archive/">Archive</a></span></div>
+<hr class="softd-sep">
+<p>Caf&eacute; &nbsp; &#8217;quoted&#8217; &lt;tag&gt;</p>
+</span></div></p>
+<p>Trailing text after stray end tags
+'''
+
+def page(css_class, article=ARTICLE):
+    return (
+        '<!DOCTYPE html><html><head><title>Page</title></head><body>'
+        '<div class="header"><p>Menu</div>'
+        f'<div class="{css_class}">{article}</div>'
+        '<div class="footer">Catholic Ireland</div>'
+        '</body></html>'
+    ).encode('utf-8')
+
+PAGES = {
+    'unclosed': page('article softd_single'),
+    'plain article': page('article'),
+    'no images': page('article softd_single', '<p>Only text<p>and more'),
+    'missing content': page('something-else'),
+}
+
+def test_default_parser_is_html_parser():
+    # lxml closes unclosed <p> and <li> elsewhere, so it is opt-in only
+    assert scraper.HTML_PARSER == 'html.parser'
+
+def test_missing_parser_falls_back_to_html_parser(monkeypatch):
+    lookup = scraper.builder_registry.lookup
+    # As on an install without lxml
+    monkeypatch.setattr(scraper.builder_registry, 'lookup', lambda *features: None if 'lxml' in features else lookup(*features))
+    assert scraper.resolve_parser('lxml') == 'html.parser'
+    assert scraper.resolve_parser('html.parser') == 'html.parser'
+
+@pytest.mark.parametrize('key', [key for key, source in scraper.SOURCES.items() if source.parser == 'html'])
+@pytest.mark.parametrize('name', PAGES)
+def test_matches_legacy_cleaning(key, name):
+    html = PAGES[name]
+    assert scraper.clean_page(key, html) == legacy_clean_page(key, html)
@@ -0,0 +1,137 @@
+# tests/test_fetcher.py
+#
+# fetcher.fetch and scraper.fetch_page against a local http.server stand-in
+# for upstream, which replays a script of responses per path and records
+# the requests it was sent.
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+
+import fetcher
+import scraper
+import storage
+from backends import MemoryBackend
+from sources import SOURCES
+
+PAGE = b'<html><body><div class="article softd_single"><p>Reading</p></div></body></html>'
+
+class Upstream(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), UpstreamHandler)
+        # path -> [(status, headers, body, delay)], replayed in order; the last one repeats
+        self.script = {}
+        # (path, headers, time) of every request received
+        self.requests = []
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+    def hits(self, path):
+        return [request for request in self.requests if request[0] == path]
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers), time.monotonic()))
+        script = self.server.script[self.path]
+        status, headers, body, delay = script.pop(0) if len(script) > 1 else script[0]
+        if delay:
+            time.sleep(delay)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def upstream():
+    server = Upstream()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    """Keep fetcher's retry policy but with a backoff short enough for tests."""
+    monkeypatch.setattr(fetcher.adapter, 'max_retries', fetcher.RETRIES.new(backoff_factor=0.1))
+
+def ok(body=PAGE, **headers):
+    return (200, headers, body, 0)
+
+NOT_MODIFIED = (304, {}, b'', 0)
+
+def test_200_stores_validators(upstream):
+    upstream.script['/page'] = [ok(ETag='"v1"', **{'Last-Modified': 'Tue, 13 Oct 2026 06:00:00 GMT'})]
+    store = MemoryBackend()
+    response = fetcher.fetch(upstream.url('/page'), store)
+    assert response.content == PAGE
+    assert store.load_validators(upstream.url('/page')) == {
+        'etag': '"v1"',
+        'last_modified': 'Tue, 13 Oct 2026 06:00:00 GMT',
+    }
+
+def test_304_returns_saved_content_without_parsing(upstream, monkeypatch):
+    key = 'daily_readings'
+    monkeypatch.setitem(SOURCES, key, SOURCES[key]._replace(url=upstream.url('/readings')))
+    upstream.script['/readings'] = [ok(ETag='"v1"'), NOT_MODIFIED]
+    store = MemoryBackend()
+    storage._l1_cache.clear()
+
+    first = scraper.scrape_content(key, store)
+    storage.save_data(store, key, first)
+
+    def parse_page(key, html):
+        raise AssertionError('an unchanged page must not be parsed')
+    monkeypatch.setattr(scraper, 'parse_page', parse_page)
+    assert scraper.scrape_content(key, store) == first
+    assert upstream.hits('/readings')[1][1].get('If-None-Match') == '"v1"'
+
+def test_304_without_saved_content_refetches_unconditionally(upstream):
+    upstream.script['/page'] = [ok(ETag='"v1"'), NOT_MODIFIED, ok()]
+    store = MemoryBackend()
+    fetcher.fetch(upstream.url('/page'), store)
+
+    response, previous = scraper.fetch_page(upstream.url('/page'), 'daily_readings', store)
+    assert previous is None
+    assert response.content == PAGE
+    conditional, unconditional = upstream.hits('/page')[1:]
+    assert conditional[1].get('If-None-Match') == '"v1"'
+    assert 'If-None-Match' not in unconditional[1]
+
+def test_5xx_is_retried_with_backoff(upstream):
+    upstream.script['/page'] = [(503, {}, b'', 0), (502, {}, b'', 0), (500, {}, b'', 0), ok()]
+    response = fetcher.fetch(upstream.url('/page'))
+    assert response.status_code == 200
+    times = [at for _, _, at in upstream.hits('/page')]
+    assert len(times) == 4
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    # Exponential backoff: 0.2 then 0.4 seconds before the second and third retries
+    assert gaps[1] >= 0.2 and gaps[2] >= 0.4
+
+def test_5xx_raises_once_retries_run_out(upstream):
+    upstream.script['/page'] = [(503, {}, b'', 0)]
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch(upstream.url('/page'))
+    assert len(upstream.hits('/page')) == fetcher.RETRIES.total + 1
+
+def test_timeout(upstream, monkeypatch):
+    monkeypatch.setattr(fetcher, 'TIMEOUT', (1, 0.2))
+    upstream.script['/slow'] = [(200, {}, PAGE, 1)]
+    started = time.monotonic()
+    # Read timeouts are retried too, then surface as a connection error
+    with pytest.raises(requests.ConnectionError):
+        fetcher.fetch(upstream.url('/slow'))
+    assert len(upstream.hits('/slow')) == fetcher.RETRIES.total + 1
+    assert time.monotonic() - started < 5
@@ -0,0 +1,67 @@
+# tests/test_mass_readings.py
+#
+# Parsing universalis mass pages and indexing their scripture references.
+
+import pytest
+
+import app as api
+import scraper
+from conftest import API_KEY
+from scripture import parse_reference
+
+MASS_PAGE = b'''<html><head><title>Universalis: Mass</title></head><body>
+<h1>Universalis</h1>
+<div id="feastname">Saint Luke, Evangelist<br>Feast</div>
+<p>Liturgical Colour: Red.</p>
+<div class="readings">
+<table><tr><th>First reading</th><th align="right">2 Timothy 4:10-17</th></tr></table>
+<div class="v">Everybody has deserted me.</div>
+<table><tr><th>Responsorial Psalm</th></tr><tr><th></th><th align="right">Psalm 144(145):10-13,17-18</th></tr></table>
+<p>Your friends, O Lord, make known the glorious splendour of your reign.</p>
+<table><tr><th>Gospel</th><th align="right">Luke 10:1-9</th></tr></table>
+<p>The Lord appointed seventy-two others.</p>
+<!-- end of readings -->
+<p>Copyright 1996-2026 Universalis Publishing Ltd</p>
+<p><a href="/about">About us</a></p>
+</div>
+</body></html>'''
+
+def test_last_reading_stops_at_footer():
+    details = scraper.parse_mass_reading_details(MASS_PAGE)
+    assert details.texts['gospel'] == 'The Lord appointed seventy-two others.'
+    assert details.gospel == 'Luke 10:1-9'
+    assert details.celebration == 'Saint Luke, Evangelist Feast'
+    assert details.colour == 'red'
+
+def test_last_reading_stops_at_end_of_its_block():
+    page = MASS_PAGE.replace(b'<!-- end of readings -->', b'</div><div class="footer-links">')
+    details = scraper.parse_mass_reading_details(page)
+    assert details.texts['gospel'] == 'The Lord appointed seventy-two others.'
+
+def test_no_celebration_without_feast_element():
+    page = MASS_PAGE.replace(b'id="feastname"', b'class="intro"')
+    assert scraper.parse_mass_reading_details(page).celebration is None
+
+@pytest.mark.parametrize('reference, book', [
+    ('1 Jn 4:7-10', '1john'),
+    ('Dn 7:9-10', 'daniel'),
+    ('Heb 4:12', 'hebrews'),
+    ('Eph 1:3-6', 'ephesians'),
+    ('Col 1:15', 'colossians'),
+    ('Phil 2:6-11', 'philippians'),
+    ('Sir 3:2-6', 'sirach'),
+    ('Dt 6:4', 'deuteronomy'),
+    ('Jn15:16', 'john'),
+    ('1 John 4:7', '1john'),
+    ('Song of Songs 2:8', 'songofsongs'),
+    ('Psalm 144(145):10-13,17-18', 'psalm'),
+])
+def test_book_aliases(reference, book):
+    assert parse_reference(reference)[0] == book
+
+def test_unknown_book_is_not_a_reference():
+    assert parse_reference('Hezekiah 1:2') is None
+
+def test_search_rejects_unknown_book():
+    response = api.app.test_client().get('/api/v1/readings?ref=Hezekiah 1:2', headers={'X-API-Key': API_KEY})
+    assert response.status_code == 400
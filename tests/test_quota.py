@@ -0,0 +1,101 @@
+# tests/test_quota.py
+#
+# Requests are authenticated by API key, from the X-API-Key header or
+# ?api_key=, and limited per key. Each worker admits requests from a local
+# bucket and syncs what it used to the client's shared bucket in the store.
+
+import pytest
+
+import api_common
+import app as api
+import quota
+from backends import MemoryBackend
+from quota import Quota, check_quota
+
+def test_buckets_are_bounded(monkeypatch):
+    monkeypatch.setattr(quota, 'MAX_BUCKETS', 100)
+    limits = Quota('docs', 5, 60)
+    store = MemoryBackend()
+    for address in range(1000):
+        assert check_quota(store, limits, f'10.0.{address // 256}.{address % 256}')
+    assert len(limits._buckets) == 100
+
+def test_recently_used_buckets_are_kept(monkeypatch):
+    monkeypatch.setattr(quota, 'MAX_BUCKETS', 2)
+    limits = Quota('docs', 5, 60)
+    limits.take('a')
+    limits.take('b')
+    limits.take('a')
+    limits.take('c')
+    assert list(limits._buckets) == ['a', 'c']
+
+def test_dropped_client_is_still_limited_by_the_store(monkeypatch):
+    monkeypatch.setattr(quota, 'MAX_BUCKETS', 1)
+    monkeypatch.setattr(quota, 'SYNC_BATCH', 1)
+    limits = Quota('docs', 3, 3600)
+    store = MemoryBackend()
+    admitted = 0
+    for _ in range(6):
+        admitted += check_quota(store, limits, 'client')
+        # Another client evicts this one's local bucket between requests
+        check_quota(store, limits, 'other')
+    assert admitted == 3
+
+# Requests through the app: authentication and per API key limits
+
+ROUTE_LIMIT = 3
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, 'API_KEYS', {'key-a', 'key-b'})
+    monkeypatch.setattr(api, 'store', MemoryBackend())
+    monkeypatch.setattr(api_common, 'ROUTE_LIMIT', ROUTE_LIMIT)
+    monkeypatch.setattr(api_common, '_route_quotas', {})
+    return api.app.test_client()
+
+@pytest.mark.parametrize('auth', [
+    {'headers': {'X-API-Key': 'key-a'}},
+    {'query_string': {'api_key': 'key-a'}},
+])
+def test_api_key_from_header_or_query(client, auth):
+    assert client.get('/api/v1/content', **auth).status_code == 200
+
+@pytest.mark.parametrize('auth', [
+    {},
+    {'headers': {'X-API-Key': 'wrong'}},
+    {'query_string': {'api_key': 'wrong'}},
+])
+def test_missing_or_invalid_key_is_unauthorized(client, auth):
+    response = client.get('/api/v1/content', **auth)
+    assert response.status_code == 401
+    assert 'API key' in response.get_json()['error']
+
+def test_limits_are_per_api_key(client):
+    # Both keys are used from the same address, and each has its own budget
+    for api_key in ('key-a', 'key-b'):
+        statuses = [client.get('/api/v1/content', headers={'X-API-Key': api_key}).status_code
+                    for _ in range(ROUTE_LIMIT + 1)]
+        assert statuses == [200] * ROUTE_LIMIT + [429]
+
+def test_header_and_query_share_the_key_budget(client):
+    for _ in range(ROUTE_LIMIT):
+        assert client.get('/api/v1/content', query_string={'api_key': 'key-a'}).status_code == 200
+    assert client.get('/api/v1/content', headers={'X-API-Key': 'key-a'}).status_code == 429
+
+# Several workers, each with its own Quota, share one bucket per client in the store
+
+def test_workers_share_the_bucket(monkeypatch):
+    monkeypatch.setattr(quota, 'SYNC_BATCH', 1)
+    store = MemoryBackend()
+    workers = [Quota('content', 10, 3600), Quota('content', 10, 3600)]
+    admitted = sum(check_quota(store, workers[index % 2], 'key-a') for index in range(40))
+    assert admitted == 10
+    # Another client's budget is untouched
+    assert check_quota(store, workers[0], 'key-b')
+
+def test_workers_overshoot_by_at_most_one_batch_each(monkeypatch):
+    monkeypatch.setattr(quota, 'SYNC_BATCH', 5)
+    store = MemoryBackend()
+    workers = [Quota('content', 20, 3600), Quota('content', 20, 3600)]
+    admitted = sum(check_quota(store, workers[index % 2], 'key-a') for index in range(100))
+    assert 20 <= admitted <= 20 + 2 * 5
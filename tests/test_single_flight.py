@@ -0,0 +1,143 @@
+# tests/test_single_flight.py
+#
+# A burst of concurrent cache misses for one key must reach upstream once:
+# one worker takes the lease and scrapes, the others wait for its result.
+
+import time
+import threading
+import fakeredis
+import pytest
+
+import app as api
+import storage
+from backends import MemoryBackend, RedisBackend
+from conftest import API_KEY
+
+CLIENTS = 20
+SCRAPE_SECONDS = 0.2
+
+@pytest.fixture(params=['memory', 'redis'])
+def store(request, monkeypatch):
+    if request.param == 'redis':
+        store = RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+    else:
+        store = MemoryBackend()
+    monkeypatch.setattr(api, 'store', store)
+    storage._l1_cache.clear()
+    yield store
+    storage._l1_cache.clear()
+
+@pytest.fixture
+def scrapes(monkeypatch):
+    """Replace the scraper with a slow stub; returns the list of keys it was called for."""
+    calls = []
+    lock = threading.Lock()
+
+    def scrape_content(key, store=None, day=None):
+        with lock:
+            calls.append(key)
+        time.sleep(SCRAPE_SECONDS)
+        if key == 'mass_reading_details':
+            return {'celebration': 'Tuesday of week 28', 'readings': []}
+        return f'<p>{key}</p>'
+
+    monkeypatch.setattr(api, 'scrape_content', scrape_content)
+    return calls
+
+def get_concurrently(path, clients=CLIENTS):
+    """GET path from clients threads released at the same moment; returns the status codes."""
+    barrier = threading.Barrier(clients)
+    statuses = []
+
+    def get():
+        client = api.app.test_client()
+        barrier.wait()
+        statuses.append(client.get(path, headers={'X-API-Key': API_KEY}).status_code)
+
+    threads = [threading.Thread(target=get) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+@pytest.mark.parametrize('path, key', [
+    ('/api/v1/content/daily_readings', 'daily_readings'),
+    ('/api/v1/mass_reading_details', 'mass_reading_details'),
+])
+def test_concurrent_misses_scrape_once(store, scrapes, path, key):
+    assert get_concurrently(path) == [200] * CLIENTS
+    assert scrapes == [key]
+
+def test_lease_taken_after_save_does_not_scrape(store):
+    # A worker that missed the cache but only gets the lease once the
+    # previous holder has saved must use that save rather than scrape again
+    storage.save_data(store, 'daily_readings', '<p>fresh</p>')
+    scraped = []
+    content, _, _ = storage.refresh_data(store, 'daily_readings', lambda: scraped.append(1), 60)
+    assert content == '<p>fresh</p>'
+    assert scraped == []
+    assert not store.lease_held('daily_readings')
+
+def test_background_refresh_skips_data_refreshed_meanwhile(store):
+    # This worker saw a stale entry, but another one has refreshed it since
+    storage.save_data(store, 'daily_readings', '<p>fresh</p>')
+    scraped = []
+    assert storage.schedule_refresh(store, 'daily_readings', lambda: scraped.append(1), 60)
+    deadline = time.time() + 5
+    while storage._pending_refreshes and time.time() < deadline:
+        time.sleep(0.01)
+    assert scraped == []
+    assert not store.lease_held('daily_readings')
+
+class CountingBackend(MemoryBackend):
+    """MemoryBackend that counts full-entry reads."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def get(self, keys):
+        self.reads += 1
+        return super().get(keys)
+
+    def load(self, keys, check=()):
+        self.reads += bool(keys)
+        return super().load(keys, check)
+
+def test_waiters_poll_the_lease_not_the_entry():
+    store = CountingBackend()
+    token = storage.acquire_lease(store, 'daily_readings')
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(
+        storage.refresh_data(store, 'daily_readings', lambda: None, 60)))
+    waiter.start()
+    time.sleep(10 * storage.LEASE_POLL_INTERVAL)
+    storage.save_data(store, 'daily_readings', '<p>scraped</p>')
+    storage.release_lease(store, 'daily_readings', token)
+    waiter.join()
+    assert result[0][0] == '<p>scraped</p>'
+    # The entry is read once, after the lease is released
+    assert store.reads == 1
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Count the keys response bodies are built for."""
+    calls = []
+    build_responses = storage.build_responses
+
+    def counting(data):
+        calls.append(data)
+        return build_responses(data)
+
+    monkeypatch.setattr(storage, 'build_responses', counting)
+    return calls
+
+@pytest.mark.parametrize('path', [
+    '/api/v1/content/daily_readings',
+    '/api/v1/content?keys=daily_readings',
+])
+def test_concurrent_misses_build_responses_once(store, scrapes, builds, path):
+    # Only save_data builds them; the holder and the waiters reuse the saved bodies
+    assert get_concurrently(path) == [200] * CLIENTS
+    assert builds == ['<p>daily_readings</p>']
@@ -0,0 +1,44 @@
+# tests/test_sources.py
+#
+# A bad source registry has to fail when it is loaded, not on the first
+# request that formats its URLs.
+
+import pytest
+
+from sources import _compile_source, source_url, SAMPLE_DATES
+
+def compile_source(**fields):
+    config = {
+        'url': 'https://www.universalis.com/{region}/mass.htm',
+        'region': 'europe.ireland',
+        'parser': 'mass_readings',
+        'ttl': 60,
+        'stale_ttl': 120,
+        'refresh_interval': 60,
+    }
+    config.update(fields)
+    return _compile_source('mass', config)
+
+def test_dated_url_is_formatted_with_region_and_date():
+    source = compile_source(dated_url='https://www.universalis.com/{region}/{date:%Y%m%d}/mass.htm')
+    assert source_url(source, SAMPLE_DATES[0]) == 'https://www.universalis.com/europe.ireland/20260131/mass.htm'
+
+@pytest.mark.parametrize('field', ['url', 'dated_url'])
+def test_region_is_required_where_it_is_used(field):
+    fields = {'region': None, 'url': 'https://example.com/mass.htm', field: 'https://example.com/{region}/{date:%Y%m%d}'}
+    with pytest.raises(ValueError, match=f'{{region}} in its {field}'):
+        compile_source(**fields)
+
+@pytest.mark.parametrize('dated_url', [
+    'https://example.com/{day:%Y%m%d}',
+    'https://example.com/{}',
+    'https://example.com/{date.weekday_name}',
+    'https://example.com/{date:%Y%m%d',
+])
+def test_malformed_dated_url_fails_at_load(dated_url):
+    with pytest.raises(ValueError, match='invalid dated_url'):
+        compile_source(dated_url=dated_url)
+
+def test_dated_url_needs_the_date():
+    with pytest.raises(ValueError, match='without a {date} field'):
+        compile_source(dated_url='https://www.universalis.com/{region}/mass.htm')
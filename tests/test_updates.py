@@ -0,0 +1,68 @@
+# tests/test_updates.py
+#
+# The update feed behind the SSE and long-poll endpoints: a key's version is
+# the ETag of its content, so only saves that change the content wake clients.
+
+import asyncio
+import pytest
+
+import backends
+import storage
+from backends import AsyncBackend, MemoryBackend
+from feed import UpdateFeed
+
+class EtagOnlyBackend(MemoryBackend):
+    """MemoryBackend the feed may only read ETags from."""
+
+    def get(self, keys):
+        raise AssertionError('the feed read whole entries')
+
+    def load(self, keys, check=()):
+        raise AssertionError('the feed loaded response bodies')
+
+@pytest.fixture
+def sync_store(monkeypatch):
+    monkeypatch.setattr(backends, 'UPDATE_POLL_INTERVAL', 0.05)
+    return EtagOnlyBackend()
+
+def run_feed(sync_store, steps):
+    """Run steps(feed) against an UpdateFeed following sync_store."""
+    async def main():
+        feed = UpdateFeed(AsyncBackend(sync_store), ['daily_readings'])
+        await feed.start()
+        try:
+            return await steps(feed)
+        finally:
+            await feed.stop()
+    return asyncio.run(main())
+
+def test_version_is_content_etag(sync_store):
+    storage.save_data(sync_store, 'daily_readings', '<p>one</p>')
+
+    async def steps(feed):
+        return feed.current(['daily_readings'])
+    etag = storage.build_responses('<p>one</p>')['etag']
+    assert run_feed(sync_store, steps) == {'daily_readings': etag}
+
+def test_missing_content_has_no_version(sync_store):
+    async def steps(feed):
+        return feed.current(['daily_readings'])
+    assert run_feed(sync_store, steps) == {'daily_readings': None}
+
+def test_identical_save_does_not_notify(sync_store):
+    storage.save_data(sync_store, 'daily_readings', '<p>one</p>')
+
+    async def steps(feed):
+        known = feed.current(['daily_readings'])
+        storage.save_data(sync_store, 'daily_readings', '<p>one</p>')
+        return await feed.wait_for_change(known, 0.3)
+    assert run_feed(sync_store, steps) is None
+
+def test_changed_save_notifies(sync_store):
+    storage.save_data(sync_store, 'daily_readings', '<p>one</p>')
+
+    async def steps(feed):
+        known = feed.current(['daily_readings'])
+        storage.save_data(sync_store, 'daily_readings', '<p>two</p>')
+        return await feed.wait_for_change(known, 2)
+    assert run_feed(sync_store, steps) == {'daily_readings': storage.build_responses('<p>two</p>')['etag']}